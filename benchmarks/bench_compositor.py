@@ -0,0 +1,91 @@
+# benchmarks/bench_compositor.py
+"""Micro-benchmark: vectorized Compositor vs the old Pillow paste/split/paste chain.
+
+Usage: python benchmarks/bench_compositor.py [--template 2000x2000] [--product 800x800] [--runs 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compositor import Compositor  # noqa: E402
+
+
+def pil_composite(template, product, x, y):
+    """The pre-Compositor path from ImageProcessor, kept here as the reference."""
+    result = template.copy()
+    result.paste(product, (x, y), product)
+    background = Image.new('RGB', result.size, (255, 255, 255))
+    background.paste(result, mask=result.split()[-1])
+    return background
+
+
+def make_product(width, height, seed=0):
+    """Random RGB product with an elliptical soft-edged alpha, like a real cutout."""
+    rng = np.random.default_rng(seed)
+    rgb = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    yy, xx = np.mgrid[0:height, 0:width]
+    dist = ((xx - width / 2) / (width / 2)) ** 2 + ((yy - height / 2) / (height / 2)) ** 2
+    alpha = np.clip((1.1 - dist) * 255 * 4, 0, 255).astype(np.uint8)
+    return Image.fromarray(np.dstack([rgb, alpha]), 'RGBA')
+
+
+def make_template(width, height, seed=1):
+    rng = np.random.default_rng(seed)
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    rgba[..., 3] = 255
+    return Image.fromarray(rgba, 'RGBA')
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def time_it(fn, runs):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--template', type=parse_size, default=(2000, 2000))
+    parser.add_argument('--product', type=parse_size, default=(800, 800))
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    template = make_template(*args.template)
+    product = make_product(*args.product)
+    x = (template.width - product.width) // 2
+    y = (template.height - product.height) // 2
+
+    compositor = Compositor()
+    prepared = Compositor.prepare_template(template)
+
+    reference = np.asarray(pil_composite(template, product, x, y), dtype=np.int16)
+    vectorized = np.asarray(compositor.composite(prepared, product, x, y), dtype=np.int16)
+    max_diff = int(np.abs(reference - vectorized).max())
+
+    pil_ms = time_it(lambda: pil_composite(template, product, x, y), args.runs)
+    vec_ms = time_it(lambda: compositor.composite(prepared, product, x, y), args.runs)
+    prepare_ms = time_it(lambda: Compositor.prepare_template(template), max(1, args.runs // 4))
+
+    print(f"template {args.template[0]}x{args.template[1]}, product {args.product[0]}x{args.product[1]}, {args.runs} runs")
+    print(f"  pillow chain      : {pil_ms:8.2f} ms/image")
+    print(f"  compositor        : {vec_ms:8.2f} ms/image  ({pil_ms / vec_ms:.1f}x)")
+    print(f"  prepare (cached)  : {prepare_ms:8.2f} ms/template")
+    print(f"  max pixel diff    : {max_diff}")
+    return 0 if max_diff <= 1 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
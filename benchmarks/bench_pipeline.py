@@ -0,0 +1,367 @@
+# benchmarks/bench_pipeline.py
+"""End-to-end pipeline benchmark: decode, background removal, compositing and encoding.
+
+Generates synthetic product photos and templates, drives
+ImageProcessor.remove_background / process_image_with_dimensions, and writes
+per-stage wall time, peak RSS and images/sec (per worker count and batch
+size) as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmarks/bench_pipeline.py --stub                      # no model needed: I/O + compositing only
+    python benchmarks/bench_pipeline.py --sizes 1,12,48 --workers 1,2,4 --batch-sizes 1,4,8
+    python benchmarks/bench_pipeline.py --stub --compare old.json   # also print the change vs an earlier run
+    python benchmarks/bench_pipeline.py --stub --format WEBP        # result encoding: time, bytes
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import metrics  # noqa: E402
+from config import Config  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from template_cache import TemplateCache  # noqa: E402
+
+BENCH_USER_ID = 0
+
+
+# -- Synthetic inputs --
+
+def photo_size(megapixels):
+    """4:3 size with roughly `megapixels` million pixels, like a phone camera."""
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    return width, width * 3 // 4
+
+
+def make_photo(megapixels, seed=0) -> bytes:
+    """Product-like JPEG: a textured object on a light, slightly noisy backdrop.
+
+    Drawn at 1/4 scale and upscaled, so even 48 MP is quick to generate and
+    compresses about like a real photo.
+    """
+    width, height = photo_size(megapixels)
+    small_w, small_h = max(1, width // 4), max(1, height // 4)
+    rng = np.random.default_rng(seed)
+
+    yy, xx = np.mgrid[0:small_h, 0:small_w]
+    inside = ((xx - small_w / 2) / (small_w * 0.3)) ** 2 + ((yy - small_h / 2) / (small_h * 0.38)) ** 2 < 1
+    pixels = np.empty((small_h, small_w, 3), dtype=np.int16)
+    pixels[:] = (232, 230, 225)
+    pixels[inside] = (170, 45, 60)
+    pixels += rng.integers(-12, 13, pixels.shape, dtype=np.int16)
+    small = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    buffer = BytesIO()
+    small.resize((width, height), Image.Resampling.BICUBIC).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_template(width, height, seed=1) -> bytes:
+    """Store-template-like JPEG: a soft gradient with a little texture."""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(200, 250, width, dtype=np.float32)[None, :, None]
+    pixels = np.broadcast_to(gradient, (height, width, 3)) + rng.normal(0, 3, (height, width, 3))
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+# -- Stub model (no download, no inference cost) --
+
+class _StubInput:
+    name = 'input.1'
+    shape = ['batch', 3, 320, 320]
+
+
+class _StubInnerSession:
+    """Mimics the onnxruntime session: returns an elliptical mask for every image."""
+
+    def get_inputs(self):
+        return [_StubInput()]
+
+    def run(self, output_names, feeds):
+        batch = next(iter(feeds.values()))
+        count, _, height, width = batch.shape
+        yy, xx = np.mgrid[0:height, 0:width]
+        blob = 1.0 - (((xx - width / 2) / (width * 0.35)) ** 2 + ((yy - height / 2) / (height * 0.4)) ** 2)
+        pred = np.clip(blob * 4, 0, 1).astype(np.float32)
+        return [np.broadcast_to(pred, (count, 1, height, width))]
+
+
+class StubSession:
+    """Stands in for a rembg session with the same normalize/inner_session interface."""
+
+    inner_session = _StubInnerSession()
+
+    def normalize(self, img, mean, std, size, *args, **kwargs):
+        from rembg.sessions.base import BaseSession
+        return BaseSession.normalize(self, img, mean, std, size)
+
+
+class StubImageProcessor(ImageProcessor):
+    """ImageProcessor whose model is the stub, so only decode/mask/composite/encode cost is measured."""
+
+    def get_session(self, model_name=None):
+        return StubSession()
+
+
+# -- Measurement helpers --
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in KB on Linux)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def stage_breakdown(deltas) -> dict:
+    """Per-stage calls / total / mean ms from metrics deltas (see metrics.Registry.collect_delta)."""
+    stages = metrics.Histogram(metrics.STAGE_SECONDS.name, '', ('stage',))
+    for delta in deltas:
+        stages.merge(delta.get(metrics.STAGE_SECONDS.name, {}))
+    breakdown = {}
+    for (stage,), (counts, total) in sorted(stages.take().items(), key=lambda item: -item[1][1]):
+        calls = sum(counts)
+        breakdown[stage] = {
+            'calls': calls,
+            'total_ms': round(total * 1000, 2),
+            'mean_ms': round(total * 1000 / calls, 2),
+        }
+    return breakdown
+
+
+def time_ms(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return round((time.perf_counter() - start) / runs * 1000, 2)
+
+
+# -- Worker side --
+
+_processor = None
+
+
+def _init_worker(stub, model):
+    global _processor
+    _processor = StubImageProcessor(model_name=model) if stub else ImageProcessor(model_name=model)
+
+
+def _ready(delay):
+    """Makes sure a pool worker is up (and its model loaded) before timing starts."""
+    time.sleep(delay)
+    metrics.REGISTRY.collect_delta()
+    return os.getpid()
+
+
+def _single_scenario(stub, model, megapixels, template_size, dims, runs):
+    """Latency of one image at one resolution. Runs in a fresh process so the peak RSS is its own."""
+    _init_worker(stub, model)
+    photo = make_photo(megapixels)
+    template_data = make_template(*template_size)
+    template_hash = TemplateCache.hash_template(template_data)
+    width, height = dims
+
+    def process():
+        return _processor.process_image_with_dimensions(
+            photo, template_data, BENCH_USER_ID, width, height, template_hash=template_hash
+        )
+
+    # Warm-up: model session, decoded template, allocator
+    result_data = process()
+    if result_data is None:
+        raise RuntimeError(f"Processing a {megapixels} MP photo failed")
+    metrics.REGISTRY.collect_delta()
+
+    remove_ms = time_ms(lambda: _processor.remove_background(photo, target_size=dims), runs)
+    remove_stages = stage_breakdown([metrics.REGISTRY.collect_delta()])
+    process_ms = time_ms(process, runs)
+    process_stages = stage_breakdown([metrics.REGISTRY.collect_delta()])
+
+    return {
+        'megapixels': megapixels,
+        'photo_size': list(photo_size(megapixels)),
+        'photo_bytes': len(photo),
+        'remove_background_ms': remove_ms,
+        'process_image_ms': process_ms,
+        'output_bytes': len(result_data),
+        'stages': {'remove_background': remove_stages, 'process_image': process_stages},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _process_chunk(photos, template_data, template_hash, dims, batch_size):
+    """One batched background removal plus compositing, the way BotHandler handles a chunk."""
+    cutouts = _processor.remove_background_batch(photos, batch_size, encode=True, target_size=dims)
+    done = 0
+    for index, cutout in enumerate(cutouts, 1):
+        if cutout is not None and _processor.compose_on_template(
+            cutout, template_data, BENCH_USER_ID, dims[0], dims[1], image_index=index, template_hash=template_hash
+        ):
+            done += 1
+    return done, metrics.REGISTRY.collect_delta(), peak_rss_mb()
+
+
+# -- Parent side --
+
+def run_single(args):
+    results = []
+    mp_context = multiprocessing.get_context('spawn')
+    for megapixels in args.sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as pool:
+            result = pool.submit(
+                _single_scenario, args.stub, args.model, megapixels, args.template, args.dims, args.runs
+            ).result()
+        results.append(result)
+        print(
+            f"  {megapixels:>3} MP  remove_background {result['remove_background_ms']:>9.1f} ms"
+            f"  process_image {result['process_image_ms']:>9.1f} ms  output {result['output_bytes'] / 1024:>7.0f} KB"
+            f"  peak RSS {result['peak_rss_mb']:>7.1f} MB"
+        )
+    return results
+
+
+def run_throughput(args):
+    photos = [make_photo(args.throughput_size, seed=i) for i in range(args.images)]
+    template_data = make_template(*args.template)
+    template_hash = TemplateCache.hash_template(template_data)
+    mp_context = multiprocessing.get_context(Config.WORKER_START_METHOD)
+
+    results = []
+    for workers in args.workers:
+        for batch_size in args.batch_sizes:
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=mp_context, initializer=_init_worker, initargs=(args.stub, args.model)
+            ) as pool:
+                # Model loading is startup cost, not throughput
+                list(pool.map(_ready, [0.2] * workers))
+                chunks = [photos[i:i + batch_size] for i in range(0, len(photos), batch_size)]
+                start = time.perf_counter()
+                outcomes = list(pool.map(
+                    _process_chunk, chunks, repeat(template_data), repeat(template_hash),
+                    repeat(args.dims), repeat(batch_size)
+                ))
+                seconds = time.perf_counter() - start
+
+            done = sum(outcome[0] for outcome in outcomes)
+            result = {
+                'workers': workers,
+                'batch_size': batch_size,
+                'megapixels': args.throughput_size,
+                'images': len(photos),
+                'succeeded': done,
+                'seconds': round(seconds, 3),
+                'images_per_sec': round(done / seconds, 2),
+                'stages': stage_breakdown([outcome[1] for outcome in outcomes]),
+                'worker_peak_rss_mb': max(outcome[2] for outcome in outcomes),
+            }
+            results.append(result)
+            print(
+                f"  workers {workers:>2}  batch {batch_size:>2}  {result['images_per_sec']:>7.2f} images/s"
+                f"  worker peak RSS {result['worker_peak_rss_mb']:>7.1f} MB"
+            )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Prints how latency and throughput changed against an earlier results file."""
+    print(f"\nChange vs {old['meta'].get('commit') or 'previous run'} (negative ms / positive images/s is better):")
+    old_single = {r['megapixels']: r for r in old.get('single', [])}
+    for result in new['single']:
+        before = old_single.get(result['megapixels'])
+        if before:
+            change = (result['process_image_ms'] - before['process_image_ms']) / before['process_image_ms'] * 100
+            print(f"  {result['megapixels']:>3} MP  process_image {before['process_image_ms']:.1f} -> {result['process_image_ms']:.1f} ms ({change:+.1f}%)")
+    old_throughput = {(r['workers'], r['batch_size']): r for r in old.get('throughput', [])}
+    for result in new['throughput']:
+        before = old_throughput.get((result['workers'], result['batch_size']))
+        if before and before['images_per_sec']:
+            change = (result['images_per_sec'] - before['images_per_sec']) / before['images_per_sec'] * 100
+            print(f"  workers {result['workers']:>2}  batch {result['batch_size']:>2}  {before['images_per_sec']:.2f} -> {result['images_per_sec']:.2f} images/s ({change:+.1f}%)")
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stub', action='store_true', help="Use a stub model (no download; measures I/O and compositing)")
+    parser.add_argument('--model', default=Config.REMBG_MODEL, help="Model tier for real runs")
+    parser.add_argument('--sizes', type=parse_ints, default=[1, 12, 48], help="Photo sizes in megapixels")
+    parser.add_argument('--template', type=parse_size, default=(2048, 2048), help="Template size")
+    parser.add_argument('--dims', type=parse_size, default=(800, 800), help="Product box on the template")
+    parser.add_argument('--format', default=Config.OUTPUT_FORMAT, help="Result format (JPEG, WEBP, PNG)")
+    parser.add_argument('--runs', type=int, default=3, help="Timed runs per single-image scenario")
+    parser.add_argument('--workers', type=parse_ints, default=sorted({1, Config.get_worker_count()}))
+    parser.add_argument('--batch-sizes', type=parse_ints, default=[1, Config.BATCH_MAX_SIZE])
+    parser.add_argument('--images', type=int, default=16, help="Images per throughput run")
+    parser.add_argument('--throughput-size', type=int, default=12, help="Photo size (MP) for throughput runs")
+    parser.add_argument('--skip-throughput', action='store_true')
+    parser.add_argument('--output', default='bench_pipeline.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args()
+    # Workers are spawned, so they pick the format up from the environment
+    os.environ['OUTPUT_FORMAT'] = args.format
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'stub': args.stub,
+            'model': None if args.stub else args.model,
+            'format': args.format,
+            'template': list(args.template),
+            'dims': list(args.dims),
+        },
+    }
+
+    print(f"Single image ({'stub model' if args.stub else args.model}, {args.runs} runs):")
+    results['single'] = run_single(args)
+    results['throughput'] = []
+    if not args.skip_throughput:
+        print(f"Throughput ({args.images} x {args.throughput_size} MP photos):")
+        results['throughput'] = run_throughput(args)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as old_file:
+            compare(json.load(old_file), results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
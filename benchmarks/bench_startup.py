@@ -0,0 +1,183 @@
+# benchmarks/bench_startup.py
+"""Startup benchmark: import time, model load and warm-up, and worker memory.
+
+Every scenario runs in a fresh interpreter so nothing is cached between them:
+
+- import: importing the bot (bot_app) - should not pull in onnxruntime/rembg
+- model: time to a ready session from the .onnx file vs the prebuilt .ort
+  file (run prepare_models.py first), split into load and warm-up
+- workers: a process WorkerPool with one task per worker, spawned vs forked
+  with PRELOAD_MODEL. PSS (proportional set size) counts shared pages once,
+  so the total PSS shows how much of the model the workers share.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --model u2netp --workers 4 --output bench_startup.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def memory_mb(pid='self'):
+    """(RSS, PSS) of a process in MB from /proc (Linux), zeros if unavailable."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    values[key] = int(rest.split()[0]) / 1024
+    except (OSError, ValueError):
+        pass
+    return round(values.get('Rss', 0.0), 1), round(values.get('Pss', 0.0), 1)
+
+
+# -- Scenarios (each runs in its own interpreter) --
+
+def scenario_import(args):
+    start = time.perf_counter()
+    import bot_app  # noqa: F401
+    seconds = time.perf_counter() - start
+    rss, pss = memory_mb()
+    return {
+        'import_s': round(seconds, 3),
+        'rss_mb': rss,
+        'pss_mb': pss,
+        'onnxruntime_imported': 'onnxruntime' in sys.modules,
+        'rembg_imported': 'rembg' in sys.modules,
+    }
+
+
+def scenario_model(args):
+    from config import Config
+    import model_registry
+
+    rss_before, _ = memory_mb()
+    start = time.perf_counter()
+    Config.MODEL_WARMUP = False
+    session = model_registry.create_session(args.model)
+    loaded = time.perf_counter()
+    model_registry.warm_up(session, model_registry.get_model_spec(args.model))
+    ready = time.perf_counter()
+    rss, pss = memory_mb()
+    return {
+        'load_s': round(loaded - start, 3),
+        'warmup_s': round(ready - loaded, 3),
+        'ready_s': round(ready - start, 3),
+        'rss_mb': rss,
+        'model_rss_mb': round(rss - rss_before, 1),
+    }
+
+
+def scenario_workers(args):
+    from PIL import Image
+    from io import BytesIO
+    from worker_pool import WorkerPool
+
+    buffer = BytesIO()
+    Image.new('RGB', (640, 480), (200, 60, 60)).save(buffer, 'JPEG')
+    photo = buffer.getvalue()
+
+    async def run():
+        start = time.perf_counter()
+        pool = WorkerPool('process', args.workers)
+        results = await asyncio.gather(*(
+            pool.submit('remove_background', photo, encode=True, model=args.model) for _ in range(args.workers)
+        ))
+        seconds = time.perf_counter() - start
+        # Private, but the only way to reach the worker pids from outside the tasks
+        pids = list(pool._executor._processes)
+        workers = [memory_mb(pid) for pid in pids]
+        parent = memory_mb()
+        pool.shutdown()
+        return {
+            'first_results_s': round(seconds, 3),
+            'ok': sum(result is not None for result in results),
+            'parent_rss_mb': parent[0],
+            'worker_rss_mb': round(sum(rss for rss, _ in workers), 1),
+            'total_pss_mb': round(parent[1] + sum(pss for _, pss in workers), 1),
+        }
+
+    return asyncio.run(run())
+
+
+SCENARIOS = {'import': scenario_import, 'model': scenario_model, 'workers': scenario_workers}
+
+
+def run_child(scenario, args, **env):
+    """Runs one scenario in a fresh interpreter with extra environment variables."""
+    command = [sys.executable, os.path.abspath(__file__), '--child', scenario, '--model', args.model,
+               '--workers', str(args.workers)]
+    child_env = {**os.environ, **{key: str(value) for key, value in env.items()}}
+    output = subprocess.run(command, env=child_env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=os.getenv('REMBG_MODEL', 'u2net'), help="Model tier to load")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes for the memory scenario")
+    parser.add_argument('--output', default='bench_startup.json', help="Where to write the JSON results")
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(SCENARIOS[args.child](args)))
+        return 0
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model': args.model,
+            'workers': args.workers,
+        },
+    }
+
+    results['import'] = run_child('import', args)
+    print(f"import bot_app      {results['import']['import_s']:>7.3f} s   RSS {results['import']['rss_mb']:>7.1f} MB"
+          f"   onnxruntime imported: {results['import']['onnxruntime_imported']}")
+
+    results['model'] = {}
+    for source, prebuilt in (('onnx', 'false'), ('ort', 'true')):
+        result = results['model'][source] = run_child('model', args, ORT_PREBUILT=prebuilt)
+        print(f"model from .{source:<5}  load {result['load_s']:>6.3f} s  warm-up {result['warmup_s']:>6.3f} s"
+              f"   +RSS {result['model_rss_mb']:>7.1f} MB")
+
+    results['workers'] = {}
+    threads = {'ORT_INTRA_OP_THREADS': 1}  # preloading needs single-threaded sessions
+    for mode, env in (('spawn', {'WORKER_START_METHOD': 'spawn'}),
+                      ('fork+preload', {'WORKER_START_METHOD': 'fork', 'PRELOAD_MODEL': 'true'})):
+        result = results['workers'][mode] = run_child('workers', args, **threads, **env)
+        print(f"{args.workers} workers {mode:<13} first results {result['first_results_s']:>6.3f} s"
+              f"   worker RSS {result['worker_rss_mb']:>7.1f} MB   total PSS {result['total_pss_mb']:>7.1f} MB")
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
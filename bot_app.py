@@ -0,0 +1,42 @@
+# bot_app.py
+"""Builds the Telegram Application used by both polling (main.py) and webhook (webhook.py) mode."""
+
+import logging
+
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+from bot_handler import BotHandler
+from config import Config
+from rate_limiter import FairRateLimiter
+from update_processor import PerUserUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def build_application(webhook: bool = False) -> Application:
+    """Creates the Application with all handlers registered.
+
+    In webhook mode there is no Updater; updates are put on
+    `application.update_queue` by the web server instead.
+    """
+    builder = (
+        Application.builder()
+        .token(Config.BOT_TOKEN)
+        # Every outgoing call goes through one fair, flood-limit aware scheduler
+        .rate_limiter(FairRateLimiter())
+        .concurrent_updates(PerUserUpdateProcessor(Config.MAX_CONCURRENT_UPDATES))
+    )
+    if webhook:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    bot_handler = BotHandler()
+    application.add_handler(CommandHandler("start", bot_handler.start_command))
+    application.add_handler(CommandHandler("model", bot_handler.model_command))
+    application.add_handler(CommandHandler("format", bot_handler.format_command))
+    application.add_handler(CommandHandler("stats", bot_handler.stats_command))
+    application.add_handler(MessageHandler(filters.PHOTO, bot_handler.handle_photo))
+    application.add_handler(MessageHandler(filters.Document.IMAGE, bot_handler.handle_document))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handler.handle_text))
+    application.add_error_handler(bot_handler.error_handler)
+    return application
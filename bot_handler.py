@@ -1,37 +1,155 @@
 # bot_handler.py
 
+import asyncio
 import logging
-import os
+import time
 from io import BytesIO
-from telegram import Update
+from telegram import InputMediaDocument, InputMediaPhoto, Update
 from telegram.ext import ContextTypes
 
+import metrics
+from scheduler import FairScheduler
 from session_manager import SessionManager
-from image_processor import ImageProcessor
+from session_reaper import SessionReaper
+from image_processor import SIZE_PATTERN, ImageProcessor
+from cutout_cache import CutoutCache
+from encoder import FILE_EXTENSIONS, OUTPUT_FORMATS, normalize_format
+from job_queue import JobQueue
+from model_registry import MODEL_SPECS
+from worker_pool import WorkerPool
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+class ProgressReporter:
+    """Edits a batch's progress message at most once per PROGRESS_EDIT_INTERVAL seconds."""
+
+    def __init__(self, bot, message, total: int, send_kwargs: dict = None):
+        self.bot = bot
+        self.message = message
+        self.total = total
+        self.send_kwargs = send_kwargs or {}
+        self._last_edit = time.monotonic()
+        self._last_done = 0
+
+    async def update(self, done: int):
+        now = time.monotonic()
+        if done == self._last_done or now - self._last_edit < Config.PROGRESS_EDIT_INTERVAL:
+            return
+        self._last_edit, self._last_done = now, done
+        try:
+            await self.bot.edit_message_text(
+                f"⚙️ Processing {self.total} images... ({done}/{self.total})",
+                chat_id=self.message.chat_id, message_id=self.message.message_id, **self.send_kwargs
+            )
+        except Exception as e:
+            # Progress is best effort, the results still go out
+            logger.warning(f"Could not update progress message: {e}")
+
+
 class BotHandler:
     def __init__(self):
+        # A typo in OUTPUT_FORMAT stops the bot here instead of failing every batch
+        normalize_format(Config.OUTPUT_FORMAT)
         self.session_manager = SessionManager()
-        self.image_processor = ImageProcessor()
+        # Heavy image work runs in the worker pool, not on the event loop
+        self.worker_pool = WorkerPool()
+        # Users take turns on the workers, nobody's big batch blocks the rest
+        self.scheduler = FairScheduler(self.worker_pool)
+        self.cutout_cache = CutoutCache(self.session_manager)
+        # With the job queue on, inference happens in worker.py processes instead
+        self.job_queue = JobQueue() if Config.JOB_QUEUE_ENABLED else None
+        # user_id -> {image_key: asyncio.Task} for cutouts started at upload time and still running;
+        # finished ones live only in the (bounded) cutout cache
+        self._speculative_cutouts = {}
+        # Idle sessions, abandoned uploads and leftover temp files are reclaimed in the background
+        self.reaper = SessionReaper(self.session_manager)
+        if Config.REAPER_INTERVAL > 0:
+            self.reaper.start()
+
+        # Read at scrape time, nothing extra on the hot path
+        metrics.REGISTRY.gauge('bot_cutout_cache_bytes', 'Bytes held by the in-process cutout cache.').set_function(
+            lambda: self.cutout_cache.stats()['bytes']
+        )
+        if self.job_queue is not None:
+            metrics.REGISTRY.gauge('bot_job_queue_depth', 'Jobs waiting for an inference worker.').set_function(
+                self.job_queue.depth
+            )
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"Processing /start for user ID: {user_id}")
-        self.session_manager.reset_session(user_id)
+        self._cancel_speculative_removal(user_id)
+        self.session_manager.reset_session(user_id, state='waiting_for_template')
+        self.worker_pool.invalidate_template(user_id)
         await update.message.reply_text(Config.WELCOME_MESSAGE)
-        self.session_manager.set_user_state(user_id, 'waiting_for_template')
     
+    async def model_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/model [name] - shows or changes the background removal model for this user."""
+        user_id = update.effective_user.id
+        available = ', '.join(MODEL_SPECS)
+
+        if not context.args:
+            await update.message.reply_text(
+                f"🧠 Current model: {self._get_user_model(user_id)}\n"
+                f"Available: {available}\n"
+                "Use /model <name> to change it."
+            )
+            return
+
+        model_name = context.args[0].strip().lower()
+        if model_name not in MODEL_SPECS:
+            await update.message.reply_text(f"❌ Unknown model. Available: {available}")
+            return
+
+        # Cutouts already in flight were made with the old model
+        self._cancel_speculative_removal(user_id)
+        self.session_manager.set_model(user_id, model_name)
+        await update.message.reply_text(f"✅ Model set to {model_name}.")
+
+    async def format_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/format [jpeg|webp|png] - shows or changes the result image format for this user."""
+        user_id = update.effective_user.id
+        available = ', '.join(name.lower() for name in OUTPUT_FORMATS)
+
+        if not context.args:
+            await update.message.reply_text(
+                f"🖼 Current format: {self._get_user_format(user_id).lower()}\n"
+                f"Available: {available} (png keeps transparency and is sent as a file)\n"
+                "Use /format <name> to change it."
+            )
+            return
+
+        try:
+            output_format = normalize_format(context.args[0])
+        except ValueError:
+            await update.message.reply_text(f"❌ Unknown format. Available: {available}")
+            return
+
+        self.session_manager.set_output_format(user_id, output_format)
+        await update.message.reply_text(f"✅ Results will be sent as {output_format.lower()}.")
+
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/stats - shows how much template storage deduplication saves."""
+        stats = self.session_manager.get_template_stats()
+        mb = 1024 * 1024
+        await update.message.reply_text(
+            "📊 Template storage\n"
+            f"Unique templates: {stats['templates']}\n"
+            f"Sessions using them: {stats['references']}\n"
+            f"Stored: {stats['stored_bytes'] / mb:.1f} MB\n"
+            f"Saved by sharing: {stats['saved_bytes'] / mb:.1f} MB"
+        )
+
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        user_state = self.session_manager.get_user_state(user_id)
+        session = await self.session_manager.get_session_fields_async(user_id, 'state', 'model')
+        user_state = session['state']
         
         if user_state == 'waiting_for_template':
             await self._handle_template_upload(update, context)
         elif user_state in ['template_set', 'collecting_images']:
-            await self._handle_product_image_upload(update, context)
+            await self._handle_product_image_upload(update, context, session['model'] or Config.REMBG_MODEL)
         else:
             await update.message.reply_text("Please use /start command first.")
     
@@ -43,7 +161,7 @@ class BotHandler:
 
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        user_state = self.session_manager.get_user_state(user_id)
+        user_state = (await self.session_manager.get_session_fields_async(user_id, 'state'))['state']
         text = update.message.text.strip().lower()
 
         if user_state == 'waiting_for_dimensions':
@@ -53,23 +171,33 @@ class BotHandler:
         else:
             await update.message.reply_text("I'm waiting for an image or a specific command. Use /start to begin.")
 
+    async def _download_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Downloads the message's photo (or image document) into memory.
+
+        Returns (file_unique_id, image bytes).
+        """
+        attachment = update.message.photo[-1] if update.message.photo else update.message.document
+        file = await context.bot.get_file(attachment.file_id)
+
+        # Download to memory instead of disk
+        with metrics.stage('download'), BytesIO() as f:
+            await file.download_to_memory(f)
+            return attachment.file_unique_id, f.getvalue()
+
     async def _handle_template_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         processing_msg = await update.message.reply_text("📥 Downloading template image...")
         
         try:
-            photo = update.message.photo[-1]
-            file = await context.bot.get_file(photo.file_id)
-            
-            # Download to memory instead of disk
-            with BytesIO() as f:
-                await file.download_to_memory(f)
-                f.seek(0)
-                template_data = f.read()
-
-            # Save template data to Redis
-            self.session_manager.set_template(user_id, template_data)
-            self.session_manager.set_user_state(user_id, 'template_set')
+            _, template_data = await self._download_image(update, context)
+
+            if len(template_data) > Config.get_template_normalize_bytes():
+                # Bade templates downscale/re-encode karke store karo taki Redis memory bounded rahe
+                template_data = await self.scheduler.submit(user_id, 'normalize_template', template_data)
+
+            # Stored once per unique template, the session just points at its hash
+            self.session_manager.set_template(user_id, template_data, state='template_set')
+            self.worker_pool.invalidate_template(user_id)
             
             await processing_msg.edit_text(
                 "✅ Template set successfully!\n\n"
@@ -79,30 +207,32 @@ class BotHandler:
             logger.error(f"Error handling template upload: {e}")
             await processing_msg.edit_text("❌ Error processing template. Please try again.")
 
-    async def _handle_product_image_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _handle_product_image_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE, model: str):
         user_id = update.effective_user.id
+        if self.job_queue is None and not self.scheduler.accepts_uploads():
+            # Backpressure: bahut kaam pending hai, naye uploads abhi mat lo
+            await update.message.reply_text(
+                "⏳ The bot is very busy right now. Please send this image again in a few minutes."
+            )
+            return
         processing_msg = await update.message.reply_text("📥 Downloading product image...")
         
         try:
-            photo = update.message.photo[-1]
-            file = await context.bot.get_file(photo.file_id)
-
-            pending_images = self.session_manager.get_pending_images(user_id)
-            image_count = len(pending_images)
-            
-            # Save to temp directory (this is fine as it's for short-term processing)
-            temp_product_path = os.path.join(Config.TEMP_DIR, f"product_{user_id}_{image_count + 1}.jpg")
-            await file.download_to_drive(temp_product_path)
+            file_unique_id, image_data = await self._download_image(update, context)
             
-            if not self.image_processor.validate_image(temp_product_path):
-                os.remove(temp_product_path)
+            with metrics.stage('validate'):
+                valid = ImageProcessor.validate_image(image_data)
+            if not valid:
                 await processing_msg.edit_text("❌ Invalid image format.")
                 return
 
-            self.session_manager.add_pending_image(user_id, temp_product_path)
-            self.session_manager.set_user_state(user_id, 'collecting_images')
+            # Pending images are tracked by their cutout cache key, the bytes live in Redis
+            image_key = CutoutCache.make_key(file_unique_id=file_unique_id)
+            # Append + state change + count in a single Redis round trip
+            total_images = await self.session_manager.add_pending_image_async(user_id, image_key, image_data)
+            if Config.SPECULATIVE_REMOVAL and self.job_queue is None:
+                self._start_speculative_removal(user_id, image_key, image_data, model)
             
-            total_images = len(self.session_manager.get_pending_images(user_id))
             await processing_msg.edit_text(
                 f"✅ Product image {total_images} received!\n\n"
                 "Send more, or type 'done' when finished."
@@ -113,35 +243,32 @@ class BotHandler:
 
     async def _handle_done_collecting(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        pending_images = self.session_manager.get_pending_images(user_id)
+        # Count + state change in one round trip (falls back to 'template_set' if nothing is pending)
+        pending_count = await self.session_manager.begin_dimensions_async(user_id)
         
-        if not pending_images:
+        if not pending_count:
             await update.message.reply_text("❌ No images to process. Please send product images first.")
-            self.session_manager.set_user_state(user_id, 'template_set')
             return
         
         await update.message.reply_text(
-            f"✅ Great! You've sent {len(pending_images)} images.\n\n"
+            f"✅ Great! You've sent {pending_count} images.\n\n"
             "📏 Now, please tell me the dimensions for the products.\n"
-            "Format: width x height (e.g., 400 x 600)"
+            "Format: width x height (e.g., 400 x 600)\n"
+            "Several sizes at once: 400x600, 800x800, 1080x1350"
         )
-        self.session_manager.set_user_state(user_id, 'waiting_for_dimensions')
 
     async def _handle_dimensions_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
-        user_id = update.effective_user.id
         try:
-            parts = [p.strip() for p in text.replace('x', ' ').split()]
-            if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
-                width, height = int(parts[0]), int(parts[1])
-            else:
-                raise ValueError("Invalid format")
+            sizes = self._parse_sizes(text)
 
-            if not (50 <= width <= 2048 and 50 <= height <= 2048):
+            if len(sizes) > Config.MAX_OUTPUT_SIZES:
+                await update.message.reply_text(f"❌ Please send at most {Config.MAX_OUTPUT_SIZES} sizes at once.")
+                return
+            if not all(50 <= width <= 2048 and 50 <= height <= 2048 for width, height in sizes):
                 await update.message.reply_text("❌ Dimensions must be between 50x50 and 2048x2048.")
                 return
 
-            self.session_manager.set_dimensions(user_id, width, height)
-            await self._process_product_images(update, context, width, height)
+            await self._process_product_images(update, context, sizes)
 
         except (ValueError, IndexError):
             await update.message.reply_text("❌ Invalid format. Please use: width x height (e.g., 500x500)")
@@ -149,48 +276,364 @@ class BotHandler:
             logger.error(f"Error handling dimensions: {e}")
             await update.message.reply_text("❌ Error processing dimensions.")
 
-    async def _process_product_images(self, update: Update, context: ContextTypes.DEFAULT_TYPE, width: int, height: int):
+    @staticmethod
+    def _parse_sizes(text: str) -> list:
+        """Parses "400x600, 800 x 800" (or a single "400 600") into [(400, 600), (800, 800)].
+
+        Raises ValueError if anything else is in the text.
+        """
+        sizes = [(int(width), int(height)) for width, height in SIZE_PATTERN.findall(text)]
+        leftover = SIZE_PATTERN.sub(' ', text).replace(',', ' ').replace(';', ' ').split()
+        if not sizes and len(leftover) == 2 and all(part.isdigit() for part in leftover):
+            return [(int(leftover[0]), int(leftover[1]))]
+        if not sizes or leftover:
+            raise ValueError("Invalid format")
+        return list(dict.fromkeys(sizes))
+
+    async def _process_product_images(self, update: Update, context: ContextTypes.DEFAULT_TYPE, sizes: list):
         user_id = update.effective_user.id
         
-        pending_images = self.session_manager.get_pending_images(user_id)
-        template_data = self.session_manager.get_template(user_id)
+        # Saves the sizes and reads images + template (already keyed by its content hash)
+        pending_images, template_data, template_hash = self.session_manager.start_batch(user_id, sizes)
         
         if not pending_images or not template_data:
             await update.message.reply_text("❌ Missing images or template. Please /start over.")
             return
 
         total = len(pending_images)
+        if self.job_queue is None and not self.scheduler.can_accept_batch(total):
+            # Images stay pending and the user stays in 'waiting_for_dimensions'
+            await update.message.reply_text(
+                f"⏳ The bot is very busy right now ({self.scheduler.backlog()} images queued).\n"
+                "Your images are saved - send the dimensions again in a few minutes."
+            )
+            return
+
+        metrics.BATCH_SIZE.observe(total)
+        model = self._get_user_model(user_id)
+        output_format = self._get_user_format(user_id)
+        await self._reply_queue_position(update, user_id, total)
         processing_msg = await update.message.reply_text(f"⚙️ Processing {total} images... (0/{total})")
         
+        with metrics.stage('batch'):
+            if self.job_queue is not None:
+                processed_count, failed_count = await self._process_via_queue(
+                    context, user_id, processing_msg, pending_images, sizes, model, template_hash, output_format
+                )
+            else:
+                processed_count, failed_count = await self._process_locally(
+                    context, user_id, processing_msg, pending_images, template_data, sizes, model, template_hash, output_format
+                )
+        
+        if len(sizes) == 1:
+            summary = f"✅ Success: {processed_count}, ❌ Failed: {failed_count}"
+        else:
+            # Counts are per file: every image is sent once per size
+            summary = (
+                f"{total} images × {len(sizes)} sizes\n"
+                f"✅ Files sent: {processed_count}, ❌ Failed: {failed_count}"
+            )
+        await processing_msg.edit_text(f"🎉 Processing Complete! {summary}")
+        
+        self.session_manager.finish_batch(user_id, pending_images)
+        await update.message.reply_text("Send more product images, or /start to use a new template.")
+
+    async def _process_locally(self, context, user_id, processing_msg, pending_images, template_data, sizes, model, template_hash, output_format):
+        """Runs the batch on this process's worker pool. Returns (processed, failed) result counts.
+
+        Each image gets one background removal, then is rendered at every size.
+        """
+        total = len(pending_images)
         processed_count, failed_count = 0, 0
+        batch_size = Config.BATCH_MAX_SIZE
+        speculative = self._speculative_cutouts.pop(user_id, {})
+        # The batch is about to wait on these, so they can't stay behind everyone else's work
+        self.scheduler.promote(user_id)
+        progress = ProgressReporter(context.bot, processing_msg, total, self._bulk_kwargs(context))
+        album = []
+        released = 0
+        self.scheduler.reserve(user_id, total)
+        
+        try:
+            for start in range(0, total, batch_size):
+                chunk = pending_images[start:start + batch_size]
+                cutouts = await self._collect_cutouts(user_id, chunk, speculative, batch_size, model)
+                # Composites of a chunk run side by side, up to the user's in-flight limit
+                results = await asyncio.gather(*[
+                    self._compose(user_id, cutout, template_data, sizes, i, template_hash, output_format)
+                    for i, cutout in enumerate(cutouts, start + 1)
+                ])
+
+                for i, rendered in enumerate(results, start + 1):
+                    for size_index, result_data in enumerate(rendered, 1):
+                        processed, failed = await self._deliver_result(
+                            context, user_id, album, result_data, output_format,
+                            last=i == total and size_index == len(sizes)
+                        )
+                        processed_count += processed
+                        failed_count += failed
+                    self.scheduler.release(user_id)
+                    released += 1
+                    await progress.update(i)
+        finally:
+            self.scheduler.release(user_id, total - released)
+        
+        # Anything not matched to a pending image is no longer needed
+        for task in speculative.values():
+            task.cancel()
         
-        for i, product_path in enumerate(pending_images, 1):
+        logger.info(f"Cutout cache stats: {self.cutout_cache.stats()}")
+        return processed_count, failed_count
+
+    async def _compose(self, user_id, cutout, template_data, sizes, image_index, template_hash, output_format) -> list:
+        """Renders one cutout on the template at every size via the scheduler; None for each size that failed."""
+        if cutout is None:
+            return [None] * len(sizes)
+        try:
+            return await self.scheduler.submit(
+                user_id, 'render_sizes',
+                cutout, template_data, user_id, sizes,
+                image_index=image_index, template_hash=template_hash, output_format=output_format
+            )
+        except Exception as e:
+            logger.error(f"Failed to process image {image_index}: {e}")
+            return [None] * len(sizes)
+
+    async def _deliver_result(self, context, user_id, album: list, result_data, output_format: str, last: bool) -> tuple:
+        """Adds a result to the pending album and sends the album once it is full (or `last`).
+
+        Returns (processed, failed) counts settled by this call.
+        """
+        processed, failed = 0, 0
+        if result_data:
+            album.append(result_data)
+        else:
+            failed += 1
+            metrics.IMAGES_PROCESSED.inc(result='failed')
+
+        # A full album goes out right away, the rest at the end
+        if len(album) == Config.ALBUM_SIZE or (album and last):
+            sent = await self._send_album(context, user_id, album, output_format)
+            processed += sent
+            failed += len(album) - sent
+            metrics.IMAGES_PROCESSED.inc(sent, result='ok')
+            metrics.IMAGES_PROCESSED.inc(len(album) - sent, result='failed')
+            album.clear()
+        return processed, failed
+
+    async def _process_via_queue(self, context, user_id, processing_msg, pending_images, sizes, model, template_hash, output_format):
+        """Hands the batch to the Redis job queue and sends results as workers finish them.
+
+        Results are numbered per image and size: image i at size s is (i - 1) * len(sizes) + s.
+        """
+        total = len(pending_images) * len(sizes)
+        job_id = self.job_queue.enqueue({
+            'user_id': user_id,
+            # The hash is the reference: a template changed mid-job can't leak into it
+            'template_ref': template_hash,
+            'template_hash': template_hash,
+            'image_keys': pending_images,
+            'sizes': [list(size) for size in sizes],
+            'model': model,
+            'output_format': output_format,
+        })
+
+        delivered = set()
+        processed_count, failed_count = 0, 0
+        progress = ProgressReporter(context.bot, processing_msg, len(pending_images), self._bulk_kwargs(context))
+        album = []
+        waited = 0
+        while waited < Config.JOB_WAIT_TIMEOUT:
+            event = await self.job_queue.wait_event_async(job_id, 5)
+            if event is None:
+                waited += 5
+                continue
+            waited = 0
+
+            if event['type'] == 'done':
+                if event.get('error'):
+                    logger.error(f"Job {job_id} for user {user_id} gave up: {event['error']}")
+                break
+
+            index = event['index']
+            if index in delivered:
+                # A retried attempt may report the same image again
+                continue
+            delivered.add(index)
             try:
-                await processing_msg.edit_text(f"⚙️ Processing {total} images... ({i}/{total})")
-                
-                result_path = self.image_processor.process_image_with_dimensions(
-                    product_path, template_data, user_id, width, height, image_index=i
-                )
-                
-                if result_path:
-                    with open(result_path, 'rb') as photo_file:
-                        await context.bot.send_photo(chat_id=user_id, photo=photo_file)
-                    os.remove(result_path)
-                    processed_count += 1
-                else:
-                    failed_count += 1
+                result_data = self.job_queue.get_result(job_id, index) if event['ok'] else None
             except Exception as e:
-                logger.error(f"Failed to process image {i}: {e}")
+                logger.error(f"Failed to fetch result {index} of job {job_id}: {e}")
+                result_data = None
+            if result_data:
+                album.append(result_data)
+            else:
                 failed_count += 1
-            finally:
-                if os.path.exists(product_path):
-                    os.remove(product_path)
-        
-        await processing_msg.edit_text(f"🎉 Processing Complete! ✅ Success: {processed_count}, ❌ Failed: {failed_count}")
-        
-        self.session_manager.clear_pending_images(user_id)
-        self.session_manager.set_user_state(user_id, 'template_set')
-        await update.message.reply_text("Send more product images, or /start to use a new template.")
+
+            if len(album) == Config.ALBUM_SIZE:
+                sent = await self._send_album(context, user_id, album, output_format)
+                processed_count += sent
+                failed_count += len(album) - sent
+                album = []
+            await progress.update(len(delivered) // len(sizes))
+        else:
+            logger.error(f"Timed out waiting for job {job_id} for user {user_id}")
+
+        if album:
+            sent = await self._send_album(context, user_id, album, output_format)
+            processed_count += sent
+            failed_count += len(album) - sent
+
+        # Images the workers never reported count as failed
+        failed_count += total - len(delivered)
+        self.job_queue.cleanup(job_id, total)
+        return processed_count, failed_count
+
+    async def _reply_queue_position(self, update: Update, user_id: int, total: int):
+        """Tells the user where their batch stands when others are already being served."""
+        if self.job_queue is not None:
+            depth = self.job_queue.depth()
+            if depth:
+                await update.message.reply_text(f"⏳ You are #{depth + 1} in the queue.")
+            return
+
+        position, eta_seconds = self.scheduler.queue_position(user_id, total)
+        if position > 1:
+            eta_minutes = max(1, round(eta_seconds / 60))
+            await update.message.reply_text(
+                f"⏳ You are #{position} in the queue, ETA about {eta_minutes} min. "
+                "Results will arrive as they're ready."
+            )
+
+    @staticmethod
+    def _bulk_kwargs(context) -> dict:
+        """Marks a Telegram call as bulk (results, progress) for the shared FairRateLimiter."""
+        if getattr(context.bot, 'rate_limiter', None) is None:
+            return {}
+        return {'rate_limit_args': {'bulk': True}}
+
+    async def _send_album(self, context, chat_id: int, photos: list, output_format: str = 'JPEG') -> int:
+        """Sends results as one album (a single photo on its own). Returns how many were delivered.
+
+        PNG results go out as files, since Telegram re-encodes photos and drops transparency.
+        """
+        try:
+            with metrics.stage('send'):
+                if output_format == 'PNG':
+                    filenames = [f"result_{i}.{FILE_EXTENSIONS[output_format]}" for i in range(1, len(photos) + 1)]
+                    if len(photos) == 1:
+                        await context.bot.send_document(
+                            chat_id=chat_id, document=photos[0], filename=filenames[0], **self._bulk_kwargs(context)
+                        )
+                    else:
+                        await context.bot.send_media_group(
+                            chat_id=chat_id,
+                            media=[InputMediaDocument(photo, filename=name) for photo, name in zip(photos, filenames)],
+                            **self._bulk_kwargs(context)
+                        )
+                elif len(photos) == 1:
+                    await context.bot.send_photo(chat_id=chat_id, photo=photos[0], **self._bulk_kwargs(context))
+                else:
+                    await context.bot.send_media_group(
+                        chat_id=chat_id,
+                        media=[InputMediaPhoto(photo) for photo in photos],
+                        **self._bulk_kwargs(context)
+                    )
+            return len(photos)
+        except Exception as e:
+            logger.error(f"Failed to send {len(photos)} results to {chat_id}: {e}")
+            return 0
+
+    def _get_user_model(self, user_id: int) -> str:
+        """Model tier chosen by the user with /model, or the deployment default."""
+        return self.session_manager.get_model(user_id) or Config.REMBG_MODEL
+
+    def _get_user_format(self, user_id: int) -> str:
+        """Result format chosen by the user with /format, or the deployment default."""
+        return normalize_format(self.session_manager.get_output_format(user_id) or Config.OUTPUT_FORMAT)
+
+    def _start_speculative_removal(self, user_id: int, image_key: str, image_data: bytes, model: str):
+        """Starts background removal as soon as an image is accepted.
+
+        The u2net mask doesn't depend on the dimensions typed later, so by the
+        time the user says 'done' most cutouts are usually ready. A finished
+        task is forgotten right away - its result is in the cutout cache - so
+        users who never say 'done' don't pin cutouts in memory.
+        """
+        user_tasks = self._speculative_cutouts.setdefault(user_id, {})
+        if image_key not in user_tasks:
+            task = asyncio.create_task(self._get_or_remove_cutout(user_id, image_key, image_data, model))
+            user_tasks[image_key] = task
+            task.add_done_callback(lambda _: self._forget_speculative_removal(user_id, image_key, task))
+
+    def _forget_speculative_removal(self, user_id: int, image_key: str, task: asyncio.Task):
+        user_tasks = self._speculative_cutouts.get(user_id)
+        # A batch may already have taken the user's tasks over
+        if user_tasks is not None and user_tasks.get(image_key) is task:
+            del user_tasks[image_key]
+            if not user_tasks:
+                del self._speculative_cutouts[user_id]
+
+    async def _get_or_remove_cutout(self, user_id: int, image_key: str, image_data: bytes, model: str):
+        """Returns the encoded cutout from the cache, running the model only on a miss."""
+        cache_key = CutoutCache.model_key(image_key, model)
+        cutout = self.cutout_cache.get(cache_key)
+        if cutout is None:
+            # Background priority: only uses workers no batch is waiting for
+            cutout = await self.scheduler.submit(
+                user_id, 'remove_background', image_data, encode=True, model=model, background=True
+            )
+            if cutout is not None:
+                self.cutout_cache.put(cache_key, cutout)
+        return cutout
+
+    def _cancel_speculative_removal(self, user_id: int):
+        """Cancels cutouts still in flight for a user (e.g. on /start)."""
+        tasks = self._speculative_cutouts.pop(user_id, {})
+        for task in tasks.values():
+            task.cancel()
+        if tasks:
+            logger.info(f"Cancelled {len(tasks)} speculative cutouts for user {user_id}")
+
+    async def _collect_cutouts(self, user_id: int, image_keys: list, speculative: dict, batch_size: int, model: str) -> list:
+        """Returns encoded cutouts for `image_keys`.
+
+        Speculative results and cache hits are reused; everything else goes
+        through one batched model run.
+        """
+        cutouts = {}
+        missing = []
+        for image_key in dict.fromkeys(image_keys):
+            if image_key in speculative:
+                continue
+            cached = self.cutout_cache.get(CutoutCache.model_key(image_key, model))
+            if cached is not None:
+                cutouts[image_key] = cached
+            else:
+                missing.append(image_key)
+
+        if missing:
+            images = [self.session_manager.get_pending_image_data(user_id, image_key) for image_key in missing]
+            try:
+                batch_results = await self.scheduler.submit(
+                    user_id, 'remove_background_batch', images, batch_size, encode=True, model=model, cost=len(images)
+                )
+            except Exception as e:
+                logger.error(f"Batched background removal failed for {len(missing)} images: {e}")
+                batch_results = [None] * len(missing)
+            for image_key, cutout in zip(missing, batch_results):
+                if cutout is not None:
+                    self.cutout_cache.put(CutoutCache.model_key(image_key, model), cutout)
+                    cutouts[image_key] = cutout
+
+        for image_key in image_keys:
+            if image_key in speculative and image_key not in cutouts:
+                try:
+                    cutouts[image_key] = await speculative[image_key]
+                except Exception as e:
+                    logger.error(f"Speculative background removal failed for {image_key}: {e}")
+
+        return [cutouts.get(image_key) for image_key in image_keys]
 
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Update {update} caused error {context.error}")
@@ -0,0 +1,253 @@
+# catalog.py
+"""Headless bulk mode: renders a directory (or manifest) of product photos onto a template.
+
+No Telegram or Redis needed, and nothing is downloaded - run prepare_models.py
+once beforehand. Images stream through worker processes a chunk at a time
+(decode, background removal, composite at every size, encode, write), so
+memory stays flat however big the catalog is. Outputs that already exist are
+skipped, so an interrupted run picks up where it stopped.
+
+Usage:
+    python catalog.py --template tpl.png --sizes "800x800, 400x600" --input photos/ --output out/
+    python catalog.py --template tpl.png --sizes 1080x1350 --manifest skus.csv --output out/ --processes 4
+
+Outputs go to <output>/<width>x<height>/<name>.<ext>. A manifest has one
+image path per line (relative to the manifest), optionally followed by a
+comma and the output name, e.g. a SKU.
+"""
+
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from config import Config
+from encoder import FILE_EXTENSIONS, normalize_format
+from image_processor import SIZE_PATTERN, ImageProcessor
+from model_registry import MODEL_SPECS, model_available, preload_for_fork
+from template_cache import TemplateCache
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# TemplateCache keys by user; the whole run shares one template
+CATALOG_USER_ID = 0
+PROGRESS_INTERVAL = 5  # seconds between progress lines
+
+_worker = {}
+
+
+def parse_sizes(value: str) -> list:
+    """Parses "800x800, 400x600" into [(800, 800), (400, 600)]."""
+    sizes = [(int(width), int(height)) for width, height in SIZE_PATTERN.findall(value)]
+    if not sizes:
+        raise argparse.ArgumentTypeError(f"No sizes in '{value}', expected e.g. 800x800,400x600")
+    return list(dict.fromkeys(sizes))
+
+
+def scan_directory(input_dir: str):
+    """(image path, output name) for every image under `input_dir`; names keep the sub-folders."""
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, filename)
+                yield path, os.path.splitext(os.path.relpath(path, input_dir))[0]
+
+
+def read_manifest(manifest_path: str):
+    """(image path, output name) for every line of a manifest."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='') as manifest_file:
+        for row in csv.reader(manifest_file):
+            if not row or not row[0].strip() or row[0].startswith('#'):
+                continue
+            path = os.path.join(base_dir, row[0].strip())
+            name = row[1].strip() if len(row) > 1 and row[1].strip() else os.path.splitext(os.path.basename(path))[0]
+            yield path, name
+
+
+def output_paths(output_dir: str, name: str, sizes: list, extension: str) -> list:
+    return [os.path.join(output_dir, f"{width}x{height}", f"{name}.{extension}") for width, height in sizes]
+
+
+def pending_chunks(items, output_dir: str, sizes: list, extension: str, chunk_size: int, skipped: list):
+    """Groups items that still miss an output into chunks of (image index, path, name); counts the rest in skipped[0].
+
+    The index is the item's 1-based position in the catalog, so it stays the same across resumed runs.
+    """
+    chunk = []
+    for image_index, (path, name) in enumerate(items, 1):
+        if all(os.path.exists(output) for output in output_paths(output_dir, name, sizes, extension)):
+            skipped[0] += 1
+            continue
+        chunk.append((image_index, path, name))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_atomic(path: str, data: bytes):
+    """Writes via a temp file, so a half-written output never counts as done on resume."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as output_file:
+        output_file.write(data)
+    os.replace(temp_path, path)
+
+
+# -- Worker side --
+
+def read_template(template_path: str) -> bytes:
+    """Reads the template and checks that it is an image, raising ValueError otherwise."""
+    try:
+        with open(template_path, 'rb') as template_file:
+            template_data = template_file.read()
+    except OSError as e:
+        raise ValueError(f"Cannot read template: {e}")
+    if not ImageProcessor.validate_image(template_data):
+        raise ValueError(f"Template {template_path} is not a readable image")
+    return template_data
+
+
+def _init_worker(template_data, sizes, output_dir, output_format, model):
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING
+    )
+    processor = ImageProcessor(model_name=model)
+    processor.rembg_session  # load + warm-up before the first chunk
+    _worker.update(
+        processor=processor,
+        template_data=template_data,
+        template_hash=TemplateCache.hash_template(template_data),
+        sizes=sizes,
+        output_dir=output_dir,
+        output_format=output_format,
+        # Cutouts only need to cover the largest box
+        target_size=(max(width for width, _ in sizes), max(height for _, height in sizes)),
+    )
+
+
+def _process_chunk(chunk):
+    """Renders one chunk of (image index, path, name) items. Returns [(name, error or None)]."""
+    processor = _worker['processor']
+    sizes = _worker['sizes']
+    extension = FILE_EXTENSIONS[_worker['output_format']]
+    cutouts = processor.remove_background_batch(
+        [path for _, path, _ in chunk], len(chunk), target_size=_worker['target_size']
+    )
+
+    results = []
+    for (image_index, path, name), cutout in zip(chunk, cutouts):
+        if cutout is None:
+            results.append((name, f"Image {image_index}: background removal failed for {path}"))
+            continue
+        rendered = processor.render_sizes(
+            cutout, _worker['template_data'], CATALOG_USER_ID, sizes, image_index=image_index,
+            template_hash=_worker['template_hash'], output_format=_worker['output_format']
+        )
+        if any(data is None for data in rendered):
+            results.append((name, f"Image {image_index}: rendering failed for {path}"))
+            continue
+        for output_path, data in zip(output_paths(_worker['output_dir'], name, sizes, extension), rendered):
+            _write_atomic(output_path, data)
+        results.append((name, None))
+    return results
+
+
+# -- Parent side --
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--template', required=True, help="Template image")
+    parser.add_argument('--sizes', required=True, type=parse_sizes, help="Product boxes, e.g. '800x800,400x600'")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="Directory of product photos (searched recursively)")
+    source.add_argument('--manifest', help="File listing product photos, one per line: path[,name]")
+    parser.add_argument('--output', required=True, help="Output directory")
+    parser.add_argument('--format', default=Config.OUTPUT_FORMAT, help="JPEG, WEBP or PNG")
+    parser.add_argument('--model', default=Config.REMBG_MODEL, choices=list(MODEL_SPECS))
+    parser.add_argument('--processes', type=int, default=Config.get_worker_count(),
+                        help="Worker processes (default: WORKER_COUNT or CPU cores)")
+    parser.add_argument('--batch-size', type=int, default=Config.BATCH_MAX_SIZE,
+                        help="Images per worker chunk (and per batched model run)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    try:
+        output_format = normalize_format(args.format)
+        # Checked here: a pool whose initializer fails just respawns workers forever
+        template_data = read_template(args.template)
+    except ValueError as e:
+        parser.error(str(e))
+    if not all(50 <= width <= Config.MAX_IMAGE_WIDTH and 50 <= height <= Config.MAX_IMAGE_HEIGHT for width, height in args.sizes):
+        parser.error(f"Sizes must be between 50x50 and {Config.MAX_IMAGE_WIDTH}x{Config.MAX_IMAGE_HEIGHT}")
+    if not model_available(args.model):
+        logger.error(f"Model '{args.model}' is not available locally. Run: python prepare_models.py {args.model}")
+        return 1
+
+    items = list(read_manifest(args.manifest) if args.manifest else scan_directory(args.input))
+    extension = FILE_EXTENSIONS[output_format]
+    skipped = [0]
+    chunks = pending_chunks(items, args.output, args.sizes, extension, args.batch_size, skipped)
+
+    # Sessions split the cores between this many workers
+    Config.WORKER_COUNT = args.processes
+    os.environ['WORKER_COUNT'] = str(args.processes)
+    preload_for_fork()
+    context = multiprocessing.get_context(Config.WORKER_START_METHOD)
+
+    done, failed = 0, []
+    start = last_report = time.monotonic()
+    logger.info(
+        f"{len(items)} images, sizes {', '.join(f'{w}x{h}' for w, h in args.sizes)}, "
+        f"{output_format}, {args.processes} processes"
+    )
+    with context.Pool(
+        args.processes, initializer=_init_worker,
+        initargs=(template_data, args.sizes, args.output, output_format, args.model)
+    ) as pool:
+        for results in pool.imap_unordered(_process_chunk, chunks):
+            for name, error in results:
+                if error:
+                    failed.append((name, error))
+                    logger.warning(error)
+                else:
+                    done += 1
+
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                remaining = len(items) - skipped[0] - done - len(failed)
+                rate = (done + len(failed)) / (now - start)
+                eta = f"{remaining / rate / 60:.1f} min" if rate else "?"
+                logger.info(
+                    f"{done + len(failed) + skipped[0]}/{len(items)} "
+                    f"({skipped[0]} skipped, {len(failed)} failed) - {rate:.2f} images/s, ETA {eta}"
+                )
+
+    elapsed = time.monotonic() - start
+    logger.info(
+        f"Finished in {elapsed:.1f}s: {done} rendered ({done / elapsed if elapsed else 0:.2f} images/s, "
+        f"{done * len(args.sizes)} files), {skipped[0]} already done, {len(failed)} failed"
+    )
+    if failed:
+        failed_path = os.path.join(args.output, 'failed.txt')
+        os.makedirs(args.output, exist_ok=True)
+        with open(failed_path, 'w') as failed_file:
+            failed_file.writelines(f"{name}\t{error}\n" for name, error in failed)
+        logger.info(f"Failed images listed in {failed_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,10 +7,18 @@ class Config:
     
     # Bot settings
     BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
+    # 'polling' (main.py, Flask + polling thread) ya 'webhook' (webhook.py, ek ASGI server)
+    BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public base URL, e.g. https://mybot.onrender.com (empty = don't register)
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # checked against X-Telegram-Bot-Api-Secret-Token
+    PORT = int(os.getenv('PORT', '8000'))
     
     # Redis settings
     # Render.com se milne wala internal Redis URL yahan ayega
     REDIS_URL = os.getenv('REDIS_URL')
+    # Hot-path session calls ko asyncio client se chalao taki event loop block na ho
+    REDIS_ASYNC = os.getenv('REDIS_ASYNC', 'false').lower() == 'true'
 
     # File settings
     MAX_FILE_SIZE_MB = 20
@@ -20,14 +28,105 @@ class Config:
     MAX_IMAGE_WIDTH = 2048
     MAX_IMAGE_HEIGHT = 2048
     PRODUCT_SCALE_FACTOR = 0.7  # Product image will be 70% of template size
+    MAX_OUTPUT_SIZES = int(os.getenv('MAX_OUTPUT_SIZES', '5'))  # sizes per batch, e.g. "400x600, 800x800"
     
     # Template settings
-    TEMPLATE_QUALITY = 95
-    OUTPUT_FORMAT = 'JPEG'
+    TEMPLATE_QUALITY = int(os.getenv('TEMPLATE_QUALITY', '95'))  # templates and JPEG/WebP results
+    
+    # Result encoding - chhoti files Telegram pe jaldi upload hoti hain
+    OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'JPEG').upper()  # JPEG, WEBP or PNG (PNG keeps transparency)
+    JPEG_SUBSAMPLING = int(os.getenv('JPEG_SUBSAMPLING', '2'))  # 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0
+    JPEG_OPTIMIZE = os.getenv('JPEG_OPTIMIZE', 'false').lower() == 'true'
+    JPEG_PROGRESSIVE = os.getenv('JPEG_PROGRESSIVE', 'false').lower() == 'true'
+    WEBP_METHOD = int(os.getenv('WEBP_METHOD', '4'))  # 0 = fastest ... 6 = smallest
+    PNG_COMPRESS_LEVEL = int(os.getenv('PNG_COMPRESS_LEVEL', '6'))
+    # Quality is lowered (down to OUTPUT_MIN_QUALITY) until a result fits, 0 = fixed quality
+    OUTPUT_TARGET_KB = int(os.getenv('OUTPUT_TARGET_KB', '0'))
+    OUTPUT_MIN_QUALITY = int(os.getenv('OUTPUT_MIN_QUALITY', '60'))
+    
+    # Telegram sending - flood limits se bachne ke liye sab outgoing calls ek shared scheduler se jaati hain
+    TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))  # messages/sec across all chats (limit ~30)
+    TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1.0'))  # seconds between bulk messages per chat
+    TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))  # retries after a RetryAfter
+    ALBUM_SIZE = 10  # results per send_media_group (Telegram allows 2-10)
+    PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', '3'))  # seconds between progress edits
+    
+    # Worker pool settings
+    # Background removal event loop se bahar in workers me chalta hai
+    WORKER_BACKEND = os.getenv('WORKER_BACKEND', 'process')  # 'process' or 'thread'
+    WORKER_COUNT = int(os.getenv('WORKER_COUNT', '0'))  # 0 = one per usable CPU, as many as memory allows
+    # Har worker apna model session load karta hai (u2net ~170 MB + ORT arenas + images)
+    WORKER_MEMORY_MB = int(os.getenv('WORKER_MEMORY_MB', '512'))
+    WORKER_COUNT_FALLBACK = 2  # when the memory limit can't be read
+    WORKER_START_METHOD = os.getenv('WORKER_START_METHOD', 'spawn')
+    # Alag users ke updates ek saath process hote hain, ek user ke updates hamesha order me
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))  # Images per batched u2net run
+    # Upload hote hi background removal shuru kar do, dimensions ka wait mat karo
+    SPECULATIVE_REMOVAL = os.getenv('SPECULATIVE_REMOVAL', 'true').lower() == 'true'
+    
+    # Fair scheduler - har user ko baari baari se worker milta hai
+    SCHEDULER_MAX_IN_FLIGHT = int(os.getenv('SCHEDULER_MAX_IN_FLIGHT', '0'))  # 0 = one task per worker
+    USER_MAX_IN_FLIGHT = int(os.getenv('USER_MAX_IN_FLIGHT', '2'))
+    QUEUE_MAX_IMAGES = int(os.getenv('QUEUE_MAX_IMAGES', '600'))  # new batches wait above this backlog
+    UPLOAD_BACKLOG_LIMIT = int(os.getenv('UPLOAD_BACKLOG_LIMIT', '400'))  # product uploads refused above this backlog
+    ETA_SECONDS_PER_IMAGE = float(os.getenv('ETA_SECONDS_PER_IMAGE', '2'))  # until real timings are measured
+    
+    # Distributed job queue (Redis) - inference separate worker.py processes me chalti hai
+    JOB_QUEUE_ENABLED = os.getenv('JOB_QUEUE_ENABLED', 'false').lower() == 'true'
+    JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '120'))  # seconds without progress before retry
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+    JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '3600'))  # seconds
+    JOB_WAIT_TIMEOUT = int(os.getenv('JOB_WAIT_TIMEOUT', '900'))  # bot gives up after this long without news
+    JOB_DEAD_LETTER_MAX = int(os.getenv('JOB_DEAD_LETTER_MAX', '1000'))  # ids of given-up jobs kept for inspection
+    # worker.py ke har process ka /metrics port (base + process index), 0 = off
+    WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '0'))
+    
+    # Cutout cache settings (same photo dobara aaye to u2net dobara na chale)
+    CUTOUT_CACHE_MAX_MB = int(os.getenv('CUTOUT_CACHE_MAX_MB', '256'))
+    CUTOUT_CACHE_REDIS = os.getenv('CUTOUT_CACHE_REDIS', 'false').lower() == 'true'
+    CUTOUT_CACHE_TTL = int(os.getenv('CUTOUT_CACHE_TTL', str(7 * 24 * 3600)))  # seconds
+    
+    # Model settings
+    # Quality vs speed: u2net, u2netp, silueta, isnet-general-use, u2net-int8
+    REMBG_MODEL = os.getenv('REMBG_MODEL', 'u2net')
+    # Models prepare_models.py downloads at build time (comma separated)
+    PREPARE_MODELS = os.getenv('PREPARE_MODELS', REMBG_MODEL)
+    
+    # onnxruntime settings (0 intra-op threads = CPU cores split between workers)
+    ORT_INTRA_OP_THREADS = int(os.getenv('ORT_INTRA_OP_THREADS', '0'))
+    ORT_INTER_OP_THREADS = int(os.getenv('ORT_INTER_OP_THREADS', '1'))
+    ORT_GRAPH_OPTIMIZATION = os.getenv('ORT_GRAPH_OPTIMIZATION', 'all')  # disable, basic, extended, all
+    ORT_ENABLE_MEM_ARENA = os.getenv('ORT_ENABLE_MEM_ARENA', 'true').lower() == 'true'
+    # prepare_models.py graph ko pehle se optimize karke .ort file me save karta hai, boot pe dobara optimize nahi hota
+    ORT_PREBUILT = os.getenv('ORT_PREBUILT', 'true').lower() == 'true'
+    # 'all' adds CPU-specific layouts - only safe if the build machine has the same CPU as production
+    ORT_PREBUILT_OPTIMIZATION = os.getenv('ORT_PREBUILT_OPTIMIZATION', 'extended')
+    MODEL_WARMUP = os.getenv('MODEL_WARMUP', 'true').lower() == 'true'  # one blank inference right after loading
+    # WORKER_START_METHOD=fork ke saath: model parent me ek baar load ho, workers copy-on-write share karein
+    PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', 'false').lower() == 'true'
+    
+    # Decoded template cache (per worker process), bounded by RGBA pixel memory
+    TEMPLATE_CACHE_MAX_MB = int(os.getenv('TEMPLATE_CACHE_MAX_MB', '256'))
+    
+    # Template storage in Redis - same template sirf ek baar store hota hai (content hash se)
+    TEMPLATE_TTL = int(os.getenv('TEMPLATE_TTL', str(7 * 24 * 3600)))  # seconds idle before a blob expires
+    SESSION_TTL = int(os.getenv('SESSION_TTL', str(7 * 24 * 3600)))  # seconds idle before a session expires
+    # Uploaded product images jinke baad user ne kabhi 'done' nahi bola - itni der idle ke baad reaper hata deta hai
+    PENDING_IMAGES_TTL = int(os.getenv('PENDING_IMAGES_TTL', str(24 * 3600)))  # seconds
+    # Pending images + stored templates ka total budget; upar jaane pe sabse purane idle sessions evict hote hain
+    SESSION_MEMORY_BUDGET_MB = int(os.getenv('SESSION_MEMORY_BUDGET_MB', '0'))  # 0 = no limit
+    SESSION_EVICT_MIN_IDLE = int(os.getenv('SESSION_EVICT_MIN_IDLE', '900'))  # never evict sessions active this recently
+    REAPER_INTERVAL = int(os.getenv('REAPER_INTERVAL', '300'))  # seconds between reaper sweeps, 0 = off
+    # Templates bigger than this are downscaled / re-encoded before storing
+    TEMPLATE_NORMALIZE_MB = float(os.getenv('TEMPLATE_NORMALIZE_MB', '2'))
+    TEMPLATE_MAX_SIDE = int(os.getenv('TEMPLATE_MAX_SIDE', '4096'))
     
     # Directories
     # Ab hum local directories ka istemal kam karenge, khaas kar templates ke liye
-    TEMP_DIR = 'temp'
+    TEMP_DIR = os.getenv('TEMP_DIR', 'temp')
+    TEMP_FILE_TTL = int(os.getenv('TEMP_FILE_TTL', '3600'))  # leftover temp files older than this are deleted
+    TEMP_DIR_BUDGET_MB = int(os.getenv('TEMP_DIR_BUDGET_MB', '0'))  # oldest files go first above this, 0 = no limit
     
     # Messages
     WELCOME_MESSAGE = """
@@ -76,6 +175,54 @@ Send another product image to process more, or use /start to change template.
         """Get max file size in bytes"""
         return cls.MAX_FILE_SIZE_MB * 1024 * 1024
     
+    @staticmethod
+    def get_cpu_count():
+        """CPUs this process may run on (a container often sees every host core in os.cpu_count())"""
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count() or 1
+    
+    @staticmethod
+    def get_memory_limit_mb():
+        """Memory available to this container (cgroup limit, else total RAM) in MB, None if unknown"""
+        limits = []
+        for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+            try:
+                with open(path) as f:
+                    value = f.read().strip()
+            except OSError:
+                continue
+            if value.isdigit():
+                limits.append(int(value) / (1024 * 1024))
+        try:
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    if line.startswith('MemTotal:'):
+                        limits.append(int(line.split()[1]) / 1024)
+                        break
+        except (OSError, ValueError):
+            pass
+        # An unlimited cgroup reports a huge number, so the smallest one is the real limit
+        return min(limits) if limits else None
+    
+    @classmethod
+    def get_template_normalize_bytes(cls):
+        """Get the template size above which it is normalized before storing"""
+        return int(cls.TEMPLATE_NORMALIZE_MB * 1024 * 1024)
+    
+    @classmethod
+    def get_worker_count(cls):
+        """Get number of image workers: WORKER_COUNT, else one per usable CPU that memory has room for"""
+        if cls.WORKER_COUNT:
+            return cls.WORKER_COUNT
+        memory_mb = cls.get_memory_limit_mb()
+        if memory_mb is None:
+            memory_workers = cls.WORKER_COUNT_FALLBACK
+        else:
+            memory_workers = int(memory_mb // cls.WORKER_MEMORY_MB)
+        return max(1, min(cls.get_cpu_count(), memory_workers))
+    
     @classmethod
     def is_supported_format(cls, format_name):
         """Check if image format is supported"""
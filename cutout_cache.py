@@ -0,0 +1,104 @@
+# cutout_cache.py
+
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class CutoutCache:
+    """Content-addressed cache of background-removed cutouts.
+
+    Values are encoded RGBA cutouts (see ImageProcessor.encode_cutout). Lookups
+    go through an in-process LRU bounded by bytes first, then the optional
+    Redis tier shared by all bot instances.
+    """
+
+    def __init__(self, session_manager=None, max_bytes: int = None, ttl: int = None):
+        self.session_manager = session_manager if Config.CUTOUT_CACHE_REDIS else None
+        self.max_bytes = max_bytes if max_bytes is not None else Config.CUTOUT_CACHE_MAX_MB * 1024 * 1024
+        self.ttl = ttl if ttl is not None else Config.CUTOUT_CACHE_TTL
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(file_unique_id: str = None, image_data: bytes = None) -> str:
+        """Builds a cache key from Telegram's file_unique_id, or a hash of the image bytes."""
+        if file_unique_id:
+            return f"tg:{file_unique_id}"
+        if image_data is None:
+            raise ValueError("Either file_unique_id or image_data is required")
+        return f"sha256:{hashlib.sha256(image_data).hexdigest()}"
+
+    @staticmethod
+    def model_key(image_key: str, model_name: str) -> str:
+        """Cutouts differ per model tier, so the cache key includes the model."""
+        return f"{model_name}:{image_key}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached cutout for `key`, or None on a miss."""
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.CUTOUT_CACHE_LOOKUPS.inc(result='hit')
+            return data
+
+        if self.session_manager is not None:
+            try:
+                data = self.session_manager.get_cutout(key)
+            except Exception as e:
+                logger.warning(f"Cutout cache Redis lookup failed: {e}")
+                data = None
+            if data is not None:
+                self.redis_hits += 1
+                metrics.CUTOUT_CACHE_LOOKUPS.inc(result='redis_hit')
+                self._store_local(key, data)
+                return data
+
+        self.misses += 1
+        metrics.CUTOUT_CACHE_LOOKUPS.inc(result='miss')
+        return None
+
+    def put(self, key: str, data: bytes):
+        """Stores an encoded cutout in every enabled tier."""
+        if not data:
+            return
+        self._store_local(key, data)
+        if self.session_manager is not None:
+            try:
+                self.session_manager.set_cutout(key, data, self.ttl)
+            except Exception as e:
+                logger.warning(f"Cutout cache Redis write failed: {e}")
+
+    def _store_local(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._current_bytes -= len(old)
+        self._entries[key] = data
+        self._current_bytes += len(data)
+        # Sabse purane (least recently used) cutouts nikaal do jab tak budget me na aa jaye
+        while self._current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._current_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and memory usage, for logging and metrics."""
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'bytes': self._current_bytes,
+        }
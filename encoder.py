@@ -0,0 +1,108 @@
+# encoder.py
+
+import logging
+from io import BytesIO
+from typing import NamedTuple
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Formats users can pick with /format; PNG keeps the template's transparency
+OUTPUT_FORMATS = ('JPEG', 'WEBP', 'PNG')
+FORMAT_ALIASES = {'JPG': 'JPEG'}
+FILE_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+
+class EncodeOptions(NamedTuple):
+    """How a result image is encoded."""
+    format: str
+    quality: int
+    subsampling: int  # JPEG chroma subsampling: 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0
+    optimize: bool
+    progressive: bool
+    target_bytes: int  # 0 = always use `quality`
+
+
+def normalize_format(output_format: str) -> str:
+    """Canonical format name, raising ValueError for unsupported ones."""
+    name = output_format.strip().upper()
+    name = FORMAT_ALIASES.get(name, name)
+    if name not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {list(OUTPUT_FORMATS)}")
+    return name
+
+
+def get_encode_options(output_format: str = None) -> EncodeOptions:
+    """Encoder settings from Config for `output_format` (default: Config.OUTPUT_FORMAT)."""
+    return EncodeOptions(
+        format=normalize_format(output_format or Config.OUTPUT_FORMAT),
+        quality=Config.TEMPLATE_QUALITY,
+        subsampling=Config.JPEG_SUBSAMPLING,
+        optimize=Config.JPEG_OPTIMIZE,
+        progressive=Config.JPEG_PROGRESSIVE,
+        target_bytes=Config.OUTPUT_TARGET_KB * 1024,
+    )
+
+
+class Encoder:
+    """Encodes result images as JPEG, WebP or PNG.
+
+    With a target size set, JPEG and WebP quality is binary-searched for
+    the best quality that still fits, starting from the quality that fit
+    last time for the same format and image size. PNG is lossless and
+    ignores the target.
+    """
+
+    def __init__(self):
+        self._last_quality = {}  # (format, size) -> quality that fit the target last time
+
+    def encode(self, image, options: EncodeOptions) -> bytes:
+        """Encodes a PIL image and records encode time and output bytes."""
+        with metrics.ENCODE_SECONDS.time(format=options.format), metrics.stage('encode'):
+            if options.target_bytes and options.format != 'PNG':
+                data = self._encode_to_target(image, options)
+            else:
+                data = self._save(image, options, options.quality)
+        metrics.ENCODED_BYTES.observe(len(data), format=options.format)
+        return data
+
+    @staticmethod
+    def _save(image, options: EncodeOptions, quality: int) -> bytes:
+        output = BytesIO()
+        if options.format == 'JPEG':
+            image.save(
+                output, 'JPEG', quality=quality, subsampling=options.subsampling,
+                optimize=options.optimize, progressive=options.progressive
+            )
+        elif options.format == 'WEBP':
+            image.save(output, 'WEBP', quality=quality, method=Config.WEBP_METHOD)
+        else:
+            image.save(output, 'PNG', compress_level=Config.PNG_COMPRESS_LEVEL)
+        return output.getvalue()
+
+    def _encode_to_target(self, image, options: EncodeOptions) -> bytes:
+        """Highest quality (OUTPUT_MIN_QUALITY..options.quality) whose output fits options.target_bytes.
+
+        If even the lowest quality doesn't fit, that smallest result is used.
+        """
+        key = (options.format, image.size)
+        low, high = min(Config.OUTPUT_MIN_QUALITY, options.quality), options.quality
+        best = None
+        quality = min(max(self._last_quality.get(key, high), low), high)
+        while low <= high:
+            data = self._save(image, options, quality)
+            if len(data) <= options.target_bytes:
+                best = (quality, data)
+                low = quality + 1
+            else:
+                high = quality - 1
+            quality = (low + high + 1) // 2
+
+        if best is None:
+            # Nothing fit, so the last attempt was the lowest quality
+            logger.debug(f"{options.format} result doesn't fit {options.target_bytes} bytes even at the lowest quality")
+            return data
+        self._last_quality[key] = best[0]
+        return best[1]
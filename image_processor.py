@@ -1,45 +1,268 @@
 # image_processor.py
 
 import logging
-import os
-from PIL import Image
-import rembg
+import math
+import re
+import numpy as np
+from PIL import Image, ImageOps
 from io import BytesIO
 
+import metrics
+from compositor import Compositor
+from config import Config
+from encoder import Encoder, get_encode_options
+from model_registry import create_session, get_model_spec
+from template_cache import TemplateCache
+
 logger = logging.getLogger(__name__)
 
+EXIF_ORIENTATION_TAG = 0x0112
+# EXIF orientations that rotate the image by 90 degrees (width and height swap)
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+# One "width x height" product box, as the bot's dimensions message and catalog.py's --sizes take it
+SIZE_PATTERN = re.compile(r'(\d+)\s*[x×*]\s*(\d+)', re.IGNORECASE)
+
 class ImageProcessor:
-    def __init__(self):
-        try:
-            self.rembg_session = rembg.new_session('u2net')
-        except Exception as e:
-            logger.warning(f"Could not initialize u2net model, using default: {e}")
-            self.rembg_session = None
+    def __init__(self, template_cache: TemplateCache = None, model_name: str = None):
+        self.template_cache = template_cache or TemplateCache.shared()
+        self.compositor = Compositor()
+        self.encoder = Encoder()
+        self.model_name = model_name or Config.REMBG_MODEL
+        # Sessions load on first use, so building a processor is cheap
+        self._sessions = {}
+
+    @property
+    def rembg_session(self):
+        return self.get_session(self.model_name)
+
+    def get_session(self, model_name: str = None):
+        """Returns the rembg session for a model tier (created on first use), or None if it can't load."""
+        model_name = model_name or self.model_name
+        if model_name not in self._sessions:
+            try:
+                self._sessions[model_name] = create_session(model_name)
+            except Exception as e:
+                logger.warning(f"Could not initialize {model_name} model, using default: {e}")
+                self._sessions[model_name] = None
+        return self._sessions[model_name]
+
+    @staticmethod
+    def _get_model_batch_limit(session):
+        """Returns how many images one ONNX run can take (None = no fixed limit)."""
+        batch_dim = session.inner_session.get_inputs()[0].shape[0]
+        # Exported graphs with a fixed batch dimension can only take that many images per run
+        return batch_dim if isinstance(batch_dim, int) else None
     
-    def validate_image(self, image_path):
+    @staticmethod
+    def _open_source(image):
+        """Accepts raw image bytes or a file path and returns something Image.open can read."""
+        return BytesIO(image) if isinstance(image, (bytes, bytearray)) else image
+
+    @staticmethod
+    def _read_image_data(image) -> bytes:
+        """Returns raw image bytes for either raw bytes or a file path."""
+        if isinstance(image, (bytes, bytearray)):
+            return bytes(image)
+        with open(image, 'rb') as input_file:
+            return input_file.read()
+
+    @classmethod
+    def validate_image(cls, image):
+        """Cheap header-level check that `image` (bytes or path) is a readable image.
+
+        Pixels are not decoded here; load_image decodes once and raises on corrupt data.
+        """
         try:
-            with Image.open(image_path) as img:
+            with Image.open(cls._open_source(image)) as img:
                 img.verify()
             return True
         except Exception as e:
             logger.error(f"Image validation failed: {e}")
             return False
     
-    def remove_background(self, image_path):
+    @staticmethod
+    def encode_cutout(image) -> bytes:
+        """Encodes an RGBA cutout losslessly for caching (fast PNG)."""
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', compress_level=1)
+        return buffer.getvalue()
+
+    @staticmethod
+    def decode_cutout(cutout_data: bytes):
+        """Decodes a cutout produced by encode_cutout."""
+        image = Image.open(BytesIO(cutout_data))
+        image.load()
+        return image
+
+    @staticmethod
+    def _covering_size(size, target_size, model_input_size):
+        """Smallest size (same aspect) that still covers both the fitted target box and the model input."""
+        width, height = size
+        fit_scale = min(target_size[0] / width, target_size[1] / height)
+        model_scale = max(model_input_size[0] / width, model_input_size[1] / height)
+        scale = min(max(fit_scale, model_scale), 1.0)
+        return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+
+    def load_image(self, image, target_size=None, model_input_size=(320, 320)):
+        """Validates and decodes an image (bytes or path) in one pass.
+
+        Returns an EXIF-oriented RGB working image no larger than needed to
+        cover `target_size` (default: the largest allowed output) and the
+        model input. JPEGs are DCT-scaled while decoding, so a 48 MP photo is
+        never decoded at full resolution. Raises on corrupt images.
+        """
+        target_size = target_size or (Config.MAX_IMAGE_WIDTH, Config.MAX_IMAGE_HEIGHT)
+        img = Image.open(self._open_source(image))
+
+        if img.format == 'JPEG':
+            draft_box = target_size
+            if img.getexif().get(EXIF_ORIENTATION_TAG, 1) in ROTATED_ORIENTATIONS:
+                # The box applies to the upright image, the decoder works on the stored one
+                draft_box = (target_size[1], target_size[0])
+            img.draft('RGB', self._covering_size(img.size, draft_box, model_input_size))
+
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        # DCT scaling only goes in powers of two, trim the rest
+        img.thumbnail(self._covering_size(img.size, target_size, model_input_size), Image.Resampling.LANCZOS)
+        return img
+
+    @staticmethod
+    def _apply_mask(img, mask):
+        """Cuts `img` out with `mask`, same as rembg's naive cutout."""
+        empty = Image.new('RGBA', img.size, 0)
+        return Image.composite(img.convert('RGBA'), empty, mask)
+
+    def remove_background(self, image, encode=False, target_size=None, model=None):
+        """Returns the RGBA cutout for an image (bytes or path), or its encoded bytes when `encode` is set.
+
+        The image is decoded once at working resolution (see load_image) and
+        the mask is applied to that working image. `model` picks a model tier
+        for this call (default: the processor's model).
+        """
         try:
-            with open(image_path, 'rb') as input_file:
-                input_data = input_file.read()
+            spec = get_model_spec(model or self.model_name)
+            session = self.get_session(model)
+            with metrics.stage('decode'):
+                img = self.load_image(image, target_size, spec.input_size)
             
-            if self.rembg_session:
-                output_data = rembg.remove(input_data, session=self.rembg_session)
+            if session:
+                with metrics.stage('inference'):
+                    mask = self._predict_masks([img], session, spec)[0]
+                with metrics.stage('mask'):
+                    cutout = self._apply_mask(img, mask)
             else:
-                output_data = rembg.remove(input_data)
+                import rembg
+                with metrics.stage('inference'):
+                    cutout = rembg.remove(img)
             
-            return Image.open(BytesIO(output_data))
+            if encode:
+                with metrics.stage('cutout_encode'):
+                    return self.encode_cutout(cutout)
+            return cutout
         except Exception as e:
             logger.error(f"Background removal failed: {e}")
             return None
             
+    def remove_background_batch(self, images, max_batch_size=None, encode=False, target_size=None, model=None):
+        """Removes backgrounds from many images (bytes or paths) using batched u2net inference.
+
+        Returns a list of RGBA cutouts (or their encoded bytes when `encode` is
+        set) in the same order as `images`, with None for images that could
+        not be processed.
+        """
+        session = self.get_session(model)
+        if session is None:
+            # No usable session for batching, fall back to one rembg call per image
+            return [self.remove_background(image, encode, target_size, model) for image in images]
+
+        spec = get_model_spec(model or self.model_name)
+        max_batch_size = max_batch_size or Config.BATCH_MAX_SIZE
+        model_batch_limit = self._get_model_batch_limit(session)
+        if model_batch_limit:
+            max_batch_size = min(max_batch_size, model_batch_limit)
+
+        results = [None] * len(images)
+        decoded = []
+        for index, image in enumerate(images):
+            try:
+                with metrics.stage('decode'):
+                    decoded.append((index, self.load_image(image, target_size, spec.input_size)))
+            except Exception as e:
+                logger.error(f"Could not open image {index + 1} for background removal: {e}")
+
+        for start in range(0, len(decoded), max_batch_size):
+            chunk = decoded[start:start + max_batch_size]
+            try:
+                with metrics.stage('inference'):
+                    masks = self._predict_masks([img for _, img in chunk], session, spec)
+            except Exception as e:
+                logger.error(f"Batched background removal failed: {e}")
+                continue
+            for (index, img), mask in zip(chunk, masks):
+                with metrics.stage('mask'):
+                    cutout = self._apply_mask(img, mask)
+                if encode:
+                    with metrics.stage('cutout_encode'):
+                        cutout = self.encode_cutout(cutout)
+                results[index] = cutout
+
+        return results
+
+    @staticmethod
+    def _predict_masks(images, session, spec):
+        """Runs one ONNX inference for all `images` and returns one L-mode mask per image."""
+        input_name = session.inner_session.get_inputs()[0].name
+        batch = np.concatenate([
+            session.normalize(img, spec.mean, spec.std, spec.input_size)[input_name]
+            for img in images
+        ])
+
+        preds = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+
+        masks = []
+        for img, pred in zip(images, preds):
+            # Per-image min/max scaling, same as rembg does for a single run
+            ma, mi = np.max(pred), np.min(pred)
+            pred = (pred - mi) / max(ma - mi, 1e-6)
+            mask = Image.fromarray((pred.clip(0, 1) * 255).astype('uint8'))
+            masks.append(mask.resize(img.size, Image.Resampling.LANCZOS))
+        return masks
+
+    def invalidate_template(self, user_id):
+        """Drops a user's decoded template from this worker's cache."""
+        self.template_cache.invalidate_user(user_id)
+
+    @staticmethod
+    def normalize_template(template_data: bytes) -> bytes:
+        """Downscales an oversized template to TEMPLATE_MAX_SIDE and re-encodes it compactly.
+
+        Templates with transparency stay PNG, everything else becomes JPEG at
+        TEMPLATE_QUALITY. Pixels are kept as the compositor already sees them
+        (no EXIF rotation). The original bytes come back if re-encoding doesn't
+        make them smaller.
+        """
+        max_side = Config.TEMPLATE_MAX_SIDE
+        with Image.open(BytesIO(template_data)) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (max_side, max_side))
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        if has_alpha:
+            img.save(output, 'PNG', optimize=True)
+        else:
+            img.save(output, 'JPEG', quality=Config.TEMPLATE_QUALITY, optimize=True)
+        normalized = output.getvalue()
+
+        if len(normalized) >= len(template_data):
+            return template_data
+        logger.info(f"Template normalized from {len(template_data)} to {len(normalized)} bytes ({img.width}x{img.height})")
+        return normalized
+
     def resize_image_to_fit(self, image, max_width, max_height, maintain_aspect=True):
         if maintain_aspect:
             image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
@@ -47,37 +270,99 @@ class ImageProcessor:
         else:
             return image.resize((max_width, max_height), Image.Resampling.LANCZOS)
 
-    def process_image_with_dimensions(self, product_path, template_data: bytes, user_id, target_width, target_height, image_index=1):
+    def process_image_with_dimensions(self, product_image, template_data: bytes, user_id, target_width, target_height, image_index=1, template_hash=None, model=None, output_format=None):
         try:
             logger.info(f"Processing image for user {user_id} with dimensions {target_width}x{target_height}")
             
-            product_no_bg = self.remove_background(product_path)
+            product_no_bg = self.remove_background(product_image, target_size=(target_width, target_height), model=model)
             if product_no_bg is None:
                 return None
 
-            product_resized = self.resize_image_to_fit(product_no_bg, target_width, target_height, maintain_aspect=True)
+            return self.compose_on_template(
+                product_no_bg, template_data, user_id, target_width, target_height, image_index, template_hash, output_format
+            )
 
-            # Open template from bytes data
-            template = Image.open(BytesIO(template_data)).convert('RGBA')
+        except Exception as e:
+            logger.error(f"Image processing with dimensions failed: {e}")
+            return None
 
-            # Center the product on the template
-            x = (template.width - product_resized.width) // 2
-            y = (template.height - product_resized.height) // 2
-            
-            result = template.copy()
-            result.paste(product_resized, (x, y), product_resized)
-            
-            # Convert to RGB for saving as JPEG
-            background = Image.new('RGB', result.size, (255, 255, 255))
-            background.paste(result, mask=result.split()[-1])
-            result = background
+    def compose_on_template(self, product_no_bg, template_data: bytes, user_id, target_width, target_height, image_index=1, template_hash=None, output_format=None):
+        """Resizes an RGBA cutout (image or encoded bytes), centers it on the template and returns the encoded result.
 
-            output_path = f"temp/result_{user_id}_{image_index}.jpg"
-            result.save(output_path, 'JPEG', quality=95)
+        `output_format` is JPEG, WEBP or PNG (default: Config.OUTPUT_FORMAT).
+        """
+        try:
+            if isinstance(product_no_bg, bytes):
+                with metrics.stage('cutout_decode'):
+                    product_no_bg = self.decode_cutout(product_no_bg)
+            with metrics.stage('resize'):
+                product_resized = self.resize_image_to_fit(product_no_bg, target_width, target_height, maintain_aspect=True)
+
+            # Decoded template comes from the cache, ready to composite onto
+            template = self.template_cache.get(user_id, template_data, template_hash)
+            result_data = self._place_on_template(template, product_resized, get_encode_options(output_format))
             
-            logger.info(f"Image processing completed for user {user_id}")
-            return output_path
+            logger.info(f"Image {image_index} processing completed for user {user_id}")
+            return result_data
             
         except Exception as e:
-            logger.error(f"Image processing with dimensions failed: {e}")
+            logger.error(f"Compositing on template failed: {e}")
             return None
+
+    @staticmethod
+    def _fitted_size(size, box):
+        """Size an image of `size` gets when fitted into `box` (aspect kept, never upscaled)."""
+        width, height = size
+        scale = min(box[0] / width, box[1] / height, 1.0)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def render_sizes(self, product_no_bg, template_data: bytes, user_id, sizes, image_index=1, template_hash=None, output_format=None):
+        """Composites one RGBA cutout (image or encoded bytes) onto the template at every size in `sizes`.
+
+        `sizes` are (width, height) product boxes, like compose_on_template's.
+        They are rendered largest first, each downscaled from the previous
+        one rather than from the full cutout. Returns the encoded result
+        (see compose_on_template) per size, in the order given, with None for
+        sizes that failed.
+        """
+        results = [None] * len(sizes)
+        try:
+            options = get_encode_options(output_format)
+            if isinstance(product_no_bg, bytes):
+                with metrics.stage('cutout_decode'):
+                    product_no_bg = self.decode_cutout(product_no_bg)
+            template = self.template_cache.get(user_id, template_data, template_hash)
+        except Exception as e:
+            logger.error(f"Rendering image {image_index} failed: {e}")
+            return results
+
+        source_size = product_no_bg.size
+        order = sorted(range(len(sizes)), key=lambda i: self._fitted_size(source_size, sizes[i]), reverse=True)
+        current = product_no_bg
+        for i in order:
+            try:
+                target_size = self._fitted_size(source_size, sizes[i])
+                if current.size != target_size:
+                    with metrics.stage('resize'):
+                        current = current.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+                results[i] = self._place_on_template(template, current, options)
+            except Exception as e:
+                logger.error(f"Rendering image {image_index} at {sizes[i][0]}x{sizes[i][1]} failed: {e}")
+
+        logger.info(f"Image {image_index} rendered at {len(sizes)} sizes for user {user_id}")
+        return results
+
+    def _place_on_template(self, template, product_resized, options) -> bytes:
+        """Centers a resized cutout on a decoded template and returns it encoded with `options`."""
+        x = (template.width - product_resized.width) // 2
+        y = (template.height - product_resized.height) // 2
+        
+        with metrics.stage('composite'):
+            if options.format == 'PNG':
+                # PNG keeps transparency, so there's nothing to flatten
+                result = self.compositor.composite_rgba(template, product_resized, x, y)
+            else:
+                # Alpha-over and flatten onto white in one pass, inside the product's box only
+                result = self.compositor.composite(template, product_resized, x, y)
+
+        return self.encoder.encode(result, options)
@@ -0,0 +1,190 @@
+# job_queue.py
+
+import json
+import logging
+import time
+import uuid
+from typing import NamedTuple, Optional
+
+from config import Config
+from session_manager import get_async_redis_client, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class Job(NamedTuple):
+    """A claimed job: its id, the payload it was enqueued with and how often it has been tried."""
+    job_id: str
+    payload: dict
+    attempts: int
+
+
+class JobQueue:
+    """Reliable Redis job queue shared by the bot and the inference workers.
+
+    Jobs wait in a pending list and are atomically moved to a processing list
+    when a worker claims them. Each claim gets a visibility deadline; workers
+    extend it while they make progress, and jobs whose deadline passes (worker
+    crashed or hung) are put back in the queue until they run out of retries.
+    Results and progress events are written per job for the bot to pick up.
+    """
+
+    PENDING_KEY = 'jobs:pending'
+    PROCESSING_KEY = 'jobs:processing'
+    DEADLINES_KEY = 'jobs:deadlines'
+    DEAD_KEY = 'jobs:dead'
+
+    def __init__(self, redis_client=None, async_redis_client=None):
+        # Results are binary, so this client must not decode responses
+        self.redis = redis_client or get_redis_client(decode_responses=False)
+        # Created on first use, so its connections belong to the bot's event loop
+        self.async_redis = async_redis_client
+        self.visibility_timeout = Config.JOB_VISIBILITY_TIMEOUT
+        self.max_attempts = Config.JOB_MAX_ATTEMPTS
+        self.result_ttl = Config.JOB_RESULT_TTL
+
+    def _get_job_key(self, job_id: str) -> str:
+        return f"job:{job_id}"
+
+    def _get_events_key(self, job_id: str) -> str:
+        return f"job:{job_id}:events"
+
+    def _get_result_key(self, job_id: str, index: int) -> str:
+        return f"job:{job_id}:result:{index}"
+
+    # -- Producer (bot) side --
+
+    def enqueue(self, payload: dict) -> str:
+        """Adds a job and returns its id."""
+        job_id = uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.hset(self._get_job_key(job_id), mapping={'payload': json.dumps(payload), 'attempts': 0})
+        pipe.expire(self._get_job_key(job_id), self.result_ttl)
+        pipe.lpush(self.PENDING_KEY, job_id)
+        pipe.execute()
+        logger.info(f"Enqueued job {job_id}")
+        return job_id
+
+    def wait_event(self, job_id: str, timeout: int = 5) -> Optional[dict]:
+        """Blocks up to `timeout` seconds for the job's next event."""
+        item = self.redis.blpop(self._get_events_key(job_id), timeout=timeout)
+        return json.loads(item[1]) if item else None
+
+    async def wait_event_async(self, job_id: str, timeout: int = 5) -> Optional[dict]:
+        """wait_event for the bot's event loop, without tying up a thread for every waiting batch."""
+        if self.async_redis is None:
+            self.async_redis = get_async_redis_client(decode_responses=False)
+        item = await self.async_redis.blpop(self._get_events_key(job_id), timeout=timeout)
+        return json.loads(item[1]) if item else None
+
+    def get_result(self, job_id: str, index: int) -> Optional[bytes]:
+        """Returns the encoded result image for one item of a job."""
+        return self.redis.get(self._get_result_key(job_id, index))
+
+    def cleanup(self, job_id: str, total: int):
+        """Deletes a finished job and everything it produced."""
+        keys = [self._get_job_key(job_id), self._get_events_key(job_id)]
+        keys += [self._get_result_key(job_id, index) for index in range(1, total + 1)]
+        self.redis.delete(*keys)
+
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return self.redis.llen(self.PENDING_KEY)
+
+    # -- Consumer (worker) side --
+
+    def claim(self, timeout: int = 5) -> Optional[Job]:
+        """Blocks up to `timeout` seconds for a job and claims it."""
+        job_id = self.redis.blmove(self.PENDING_KEY, self.PROCESSING_KEY, timeout, 'RIGHT', 'LEFT')
+        if job_id is None:
+            return None
+        job_id = job_id.decode()
+
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.DEADLINES_KEY, {job_id: time.time() + self.visibility_timeout})
+        pipe.hincrby(self._get_job_key(job_id), 'attempts', 1)
+        pipe.hget(self._get_job_key(job_id), 'payload')
+        # HINCRBY recreates a hash the bot already cleaned up; the TTL keeps that from leaking
+        pipe.expire(self._get_job_key(job_id), self.result_ttl)
+        _, attempts, payload, _ = pipe.execute()
+
+        if payload is None:
+            # Job was cleaned up while it was queued
+            self._finish(job_id)
+            return None
+        return Job(job_id, json.loads(payload), attempts)
+
+    def touch(self, job_id: str):
+        """Extends the visibility deadline of a job that is still making progress."""
+        self.redis.zadd(self.DEADLINES_KEY, {job_id: time.time() + self.visibility_timeout}, xx=True)
+
+    def is_item_done(self, job_id: str, index: int) -> bool:
+        """True if an earlier attempt already produced this item (so retries don't resend it)."""
+        return bool(self.redis.hexists(self._get_job_key(job_id), f"done:{index}"))
+
+    def push_result(self, job_id: str, index: int, result_data: Optional[bytes]):
+        """Stores one item's result (None = failed) and notifies the bot."""
+        pipe = self.redis.pipeline()
+        if result_data:
+            pipe.set(self._get_result_key(job_id, index), result_data, ex=self.result_ttl)
+        pipe.hset(self._get_job_key(job_id), f"done:{index}", 1)
+        pipe.expire(self._get_job_key(job_id), self.result_ttl)
+        pipe.rpush(self._get_events_key(job_id), json.dumps({'type': 'result', 'index': index, 'ok': bool(result_data)}))
+        pipe.expire(self._get_events_key(job_id), self.result_ttl)
+        pipe.execute()
+
+    def complete(self, job_id: str):
+        """Marks a job finished and tells the bot."""
+        self._push_done(job_id)
+        self._finish(job_id)
+
+    def fail(self, job_id: str, attempts: int, error: str):
+        """Retries a failed job, or gives up once it has used all its attempts."""
+        if attempts < self.max_attempts:
+            logger.warning(f"Job {job_id} failed (attempt {attempts}), retrying: {error}")
+            pipe = self.redis.pipeline()
+            pipe.lrem(self.PROCESSING_KEY, 0, job_id)
+            pipe.zrem(self.DEADLINES_KEY, job_id)
+            pipe.rpush(self.PENDING_KEY, job_id)  # front of the queue
+            pipe.execute()
+            return
+
+        logger.error(f"Job {job_id} failed after {attempts} attempts: {error}")
+        pipe = self.redis.pipeline()
+        pipe.lpush(self.DEAD_KEY, job_id)
+        pipe.ltrim(self.DEAD_KEY, 0, Config.JOB_DEAD_LETTER_MAX - 1)
+        pipe.execute()
+        self._push_done(job_id, error)
+        self._finish(job_id)
+
+    def requeue_expired(self) -> int:
+        """Puts jobs whose visibility deadline has passed back in the queue. Returns how many."""
+        now = time.time()
+        requeued = 0
+        for job_id in self.redis.lrange(self.PROCESSING_KEY, 0, -1):
+            job_id = job_id.decode()
+            deadline = self.redis.zscore(self.DEADLINES_KEY, job_id)
+            if deadline is None:
+                # Claimer died between moving the job and setting its deadline
+                self.redis.zadd(self.DEADLINES_KEY, {job_id: now + self.visibility_timeout}, nx=True)
+                continue
+            if deadline > now:
+                continue
+            # Only one caller may requeue a given expired job
+            if self.redis.zrem(self.DEADLINES_KEY, job_id):
+                attempts = int(self.redis.hget(self._get_job_key(job_id), 'attempts') or 0)
+                self.fail(job_id, attempts, "visibility timeout expired")
+                requeued += 1
+        return requeued
+
+    def _push_done(self, job_id: str, error: str = None):
+        pipe = self.redis.pipeline()
+        pipe.rpush(self._get_events_key(job_id), json.dumps({'type': 'done', 'error': error}))
+        pipe.expire(self._get_events_key(job_id), self.result_ttl)
+        pipe.execute()
+
+    def _finish(self, job_id: str):
+        pipe = self.redis.pipeline()
+        pipe.lrem(self.PROCESSING_KEY, 0, job_id)
+        pipe.zrem(self.DEADLINES_KEY, job_id)
+        pipe.execute()
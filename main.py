@@ -1,12 +1,11 @@
 # main.py
 
 import logging
-import os
 import threading
 from flask import Flask
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
-from bot_handler import BotHandler
+import metrics
+from bot_app import build_application
 from config import Config
 
 # Configure logging
@@ -27,16 +26,8 @@ def run_bot():
         logger.error("FATAL: TELEGRAM_BOT_TOKEN environment variable not set!")
         return
         
-    # Application setup
-    application = Application.builder().token(bot_token).build()
-    
-    # Handler setup
-    bot_handler = BotHandler()
-    application.add_handler(CommandHandler("start", bot_handler.start_command))
-    application.add_handler(MessageHandler(filters.PHOTO, bot_handler.handle_photo))
-    application.add_handler(MessageHandler(filters.Document.IMAGE, bot_handler.handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handler.handle_text))
-    application.add_error_handler(bot_handler.error_handler)
+    # Application setup (handlers, rate limiter, per-user update processing)
+    application = build_application()
 
     # Bot ko start karo
     logger.info("Bot polling is starting now...")
@@ -45,14 +36,15 @@ def run_bot():
 
 
 # -- Ye code ab Gunicorn ke import karte hi chalega --
-# 1. Temp directory banao
-os.makedirs(Config.TEMP_DIR, exist_ok=True)
-
-# 2. Bot ko ek alag thread me chalao
+# Bot ko ek alag thread me chalao (images memory me process hoti hain, temp dir ki zarurat nahi)
+# Webhook mode me bot webhook.py (ASGI) se chalta hai, yahan polling mat karo
 bot_thread = threading.Thread(target=run_bot)
 bot_thread.daemon = True
-bot_thread.start()
-logger.info("Bot thread has been created and started.")
+if Config.BOT_MODE == 'polling':
+    bot_thread.start()
+    logger.info("Bot thread has been created and started.")
+else:
+    logger.warning(f"BOT_MODE is '{Config.BOT_MODE}', not polling. Run webhook.py to serve the bot.")
 
 
 # -- Flask App (Render ke health check ke liye) --
@@ -69,3 +61,9 @@ def home():
     logger.info(f"Health check endpoint hit. Bot status: {bot_status}")
     
     return f"<h1>Bot status: {bot_status}</h1>", status_code
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint: per-stage timings, throughput, cache and queue stats."""
+    return metrics.REGISTRY.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
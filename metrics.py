@@ -0,0 +1,308 @@
+# metrics.py
+"""Lightweight in-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain dicts behind a lock, so recording a sample
+costs about a microsecond. Process workers ship what they recorded back to
+the parent with each result (see collect_delta / merge), so one /metrics
+scrape covers the whole bot.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds: covers a 5 ms resize up to a slow 30 s upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples()]
+        return lines
+
+    def take(self) -> dict:
+        """Returns the recorded values and resets them (for shipping to another process)."""
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+
+class Counter(_Metric):
+    """Monotonic counter, e.g. images processed."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge(_Metric):
+    """Point-in-time value. Either set() it or give it a function that is read at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Reads the (unlabelled) value from `function()` on every scrape."""
+        self._function = function
+
+    def take(self) -> dict:
+        # Gauges describe this process, they are never shipped elsewhere
+        return {}
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                yield self.name, '', self._function()
+            except Exception as e:
+                logger.warning(f"Could not read gauge {self.name}: {e}")
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution, e.g. seconds per stage or images per batch."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (last one is +Inf), sum]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels) -> _Timer:
+        """Context manager that observes the wall time of its block."""
+        return _Timer(self, labels)
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                state = self._values.get(key)
+                if state is None:
+                    state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))]), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """All metrics of this process, rendered together for /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames, buckets)
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def collect_delta(self) -> dict:
+        """Takes everything recorded since the last call; picklable, for merge() in another process."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        delta = {}
+        for metric in metrics:
+            values = metric.take()
+            if values:
+                delta[metric.name] = values
+        return delta
+
+    def merge(self, delta: dict):
+        """Adds samples collected by collect_delta() in a worker process."""
+        for name, values in delta.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'bot_stage_seconds', 'Wall time per processing stage (batched stages are timed per run).', ('stage',)
+)
+IMAGES_PROCESSED = REGISTRY.counter(
+    'bot_images_processed_total', 'Product images finished, by result (ok, failed).', ('result',)
+)
+BATCH_SIZE = REGISTRY.histogram(
+    'bot_batch_size_images', 'Product images per user batch.', buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+CUTOUT_CACHE_LOOKUPS = REGISTRY.counter(
+    'bot_cutout_cache_lookups_total', 'Cutout cache lookups, by result (hit, redis_hit, miss).', ('result',)
+)
+TEMPLATE_CACHE_LOOKUPS = REGISTRY.counter(
+    'bot_template_cache_lookups_total', 'Decoded template cache lookups, by result (hit, miss).', ('result',)
+)
+ENCODE_SECONDS = REGISTRY.histogram(
+    'bot_encode_seconds', 'Time to encode one result image, including any target-size search.', ('format',)
+)
+ENCODED_BYTES = REGISTRY.histogram(
+    'bot_encoded_bytes', 'Size of encoded result images.', ('format',),
+    buckets=(32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6)
+)
+
+RECLAIMED_BYTES = REGISTRY.counter(
+    'bot_reclaimed_bytes_total', 'Bytes freed by the session reaper, by kind (pending_images, templates, temp_files).', ('kind',)
+)
+SESSIONS_EVICTED = REGISTRY.counter(
+    'bot_sessions_evicted_total', 'Sessions removed by the reaper, by reason (idle, budget).', ('reason',)
+)
+SESSION_STORE_BYTES = REGISTRY.gauge(
+    'bot_session_store_bytes', 'Bytes held at the last reaper sweep, by kind (pending_images, templates, temp_files).', ('kind',)
+)
+
+
+def stage(name: str) -> _Timer:
+    """`with metrics.stage('inference'):` records the block's wall time under that stage."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Serves /metrics from a daemon thread (for processes without the Flask app, e.g. worker.py)."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
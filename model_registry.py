@@ -0,0 +1,244 @@
+# model_registry.py
+
+import logging
+import os
+import time
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+from config import Config
+
+# onnxruntime and rembg are imported when a session is first built, so
+# processes that never run inference (the bot itself) don't pay for them.
+# rembg pulls in pymatting, whose numba kernels default to the TBB threading
+# layer; started from a worker thread or before a fork, that hangs the
+# process on exit. We never use alpha matting, so the simple layer will do.
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'workqueue')
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSpec(NamedTuple):
+    """How to build a background-removal session and feed it images."""
+    rembg_name: str
+    mean: Tuple[float, float, float]
+    std: Tuple[float, float, float]
+    input_size: Tuple[int, int]
+
+
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD = (0.229, 0.224, 0.225)
+
+# Quality vs latency tiers; names are what users and Config.REMBG_MODEL use
+MODEL_SPECS = {
+    'u2net': ModelSpec('u2net', U2NET_MEAN, U2NET_STD, (320, 320)),
+    'u2netp': ModelSpec('u2netp', U2NET_MEAN, U2NET_STD, (320, 320)),
+    'silueta': ModelSpec('silueta', U2NET_MEAN, U2NET_STD, (320, 320)),
+    'isnet-general-use': ModelSpec('isnet-general-use', (0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+    # int8 u2net, produced by prepare_models.py
+    'u2net-int8': ModelSpec('u2net_custom', U2NET_MEAN, U2NET_STD, (320, 320)),
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+
+# Sessions loaded before forking workers (see preload_sessions), shared copy-on-write
+_preloaded_sessions = {}
+
+
+def get_model_spec(model_name: str) -> ModelSpec:
+    """Returns the spec for a model tier, raising ValueError for unknown names."""
+    try:
+        return MODEL_SPECS[model_name]
+    except KeyError:
+        raise ValueError(f"Unknown model '{model_name}', expected one of {list(MODEL_SPECS)}")
+
+
+def _rembg_home() -> str:
+    from rembg.sessions.base import BaseSession
+    return BaseSession.rembg_home()
+
+
+def quantized_model_path() -> str:
+    """Where prepare_models.py writes the int8 u2net (must live under rembg's model home)."""
+    return os.path.join(_rembg_home(), 'models', 'u2net_custom', 'u2net-int8.onnx')
+
+
+def downloaded_model_path(model_name: str) -> str:
+    """Path of the .onnx file rembg ships for a tier, downloading it first if needed."""
+    from rembg.sessions import sessions
+    return str(sessions[get_model_spec(model_name).rembg_name].download_models())
+
+
+def batched_model_path(model_name: str) -> str:
+    """Where prepare_models.py writes a copy of a tier's graph with a symbolic batch dimension.
+
+    Kept apart from rembg's own file, which rembg re-downloads if its checksum changes.
+    """
+    return os.path.join(_rembg_home(), 'models', 'batched', f"{model_name}.onnx")
+
+
+def source_model_path(model_name: str) -> str:
+    """Path of the .onnx file a tier is built from: the int8 or dynamic-batch copy when prepared, else rembg's."""
+    if model_name == 'u2net-int8':
+        return quantized_model_path()
+    if os.path.exists(batched_model_path(model_name)):
+        return batched_model_path(model_name)
+    return downloaded_model_path(model_name)
+
+
+def optimized_model_path(model_name: str) -> str:
+    """Where prepare_models.py writes a tier's pre-optimized ORT-format graph.
+
+    ORT-format files are tied to the onnxruntime version and optimization
+    level that produced them, so both are part of the name.
+    """
+    import onnxruntime as ort
+    level = Config.ORT_PREBUILT_OPTIMIZATION.lower()
+    return os.path.join(_rembg_home(), 'models', 'optimized', f"{model_name}-ort{ort.__version__}-{level}.ort")
+
+
+def default_intra_op_threads() -> int:
+    """Splits the CPU cores between workers so sessions don't oversubscribe them."""
+    if Config.ORT_INTRA_OP_THREADS:
+        return Config.ORT_INTRA_OP_THREADS
+    return max(1, Config.get_cpu_count() // Config.get_worker_count())
+
+
+def model_available(model_name: str) -> bool:
+    """Whether a tier can be loaded from local files, without downloading anything."""
+    if Config.ORT_PREBUILT and os.path.exists(optimized_model_path(model_name)):
+        return True
+    if model_name == 'u2net-int8':
+        return os.path.exists(quantized_model_path())
+    if os.path.exists(batched_model_path(model_name)):
+        return True
+    from rembg.sessions import sessions
+    session_class = sessions[get_model_spec(model_name).rembg_name]
+    return session_class.resolve_existing(f"{session_class.name()}.onnx") is not None
+
+
+def build_session_options(optimization: str = None):
+    """onnxruntime session options from Config (`optimization` overrides ORT_GRAPH_OPTIMIZATION)."""
+    import onnxruntime as ort
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = default_intra_op_threads()
+    sess_opts.inter_op_num_threads = Config.ORT_INTER_OP_THREADS
+    sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    level = GRAPH_OPTIMIZATION_LEVELS.get((optimization or Config.ORT_GRAPH_OPTIMIZATION).lower(), 'ORT_ENABLE_ALL')
+    sess_opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+    sess_opts.enable_cpu_mem_arena = Config.ORT_ENABLE_MEM_ARENA
+    return sess_opts
+
+
+def _load_model_file(spec: ModelSpec, model_path: str, sess_opts):
+    """rembg session of the tier's own class, backed by `model_path` instead of rembg's download."""
+    from rembg.sessions import sessions
+    session_class = sessions[spec.rembg_name]
+    # rembg finds the model file through download_models(); point it at ours
+    file_class = type(session_class.__name__, (session_class,), {
+        'download_models': classmethod(lambda cls, *args, **kwargs: model_path),
+    })
+    # The custom session class insists on being told its file
+    kwargs = {'model_path': model_path} if spec.rembg_name == 'u2net_custom' else {}
+    return file_class(spec.rembg_name, sess_opts, **kwargs)
+
+
+def _load_prebuilt(spec: ModelSpec, model_path: str):
+    """rembg session of the tier's own class, backed by a pre-optimized .ort file."""
+    # Already optimized at build time, nothing left to do at load
+    sess_opts = build_session_options('disable')
+    sess_opts.add_session_config_entry('session.load_model_format', 'ORT')
+    return _load_model_file(spec, model_path, sess_opts)
+
+
+def warm_up(session, spec: ModelSpec):
+    """Runs one inference on a blank input so the first real image doesn't pay for kernel setup."""
+    model_input = session.inner_session.get_inputs()[0]
+    batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else 1
+    blank = np.zeros((batch, 3, spec.input_size[1], spec.input_size[0]), dtype=np.float32)
+    session.inner_session.run(None, {model_input.name: blank})
+
+
+def create_session(model_name: str):
+    """Creates a rembg session for a model tier with tuned onnxruntime options.
+
+    Uses the pre-optimized ORT-format graph from prepare_models.py when there
+    is one (falling back to the .onnx file), and warms it up when MODEL_WARMUP
+    is set. A session preloaded before forking is reused as is.
+    """
+    if model_name in _preloaded_sessions:
+        return _preloaded_sessions[model_name]
+
+    import rembg
+    spec = get_model_spec(model_name)
+    start = time.perf_counter()
+    session = None
+    source = 'onnx'
+    if Config.ORT_PREBUILT:
+        prebuilt_path = optimized_model_path(model_name)
+        if os.path.exists(prebuilt_path):
+            try:
+                session = _load_prebuilt(spec, prebuilt_path)
+                source = 'ort'
+            except Exception as e:
+                logger.warning(f"Could not load prebuilt model {prebuilt_path}, using the .onnx file: {e}")
+
+    if session is None and spec.rembg_name != 'u2net_custom' and os.path.exists(batched_model_path(model_name)):
+        session = _load_model_file(spec, batched_model_path(model_name), build_session_options())
+        source = 'batched onnx'
+    if session is None:
+        kwargs = {}
+        if spec.rembg_name == 'u2net_custom':
+            kwargs['model_path'] = quantized_model_path()
+            if not os.path.exists(kwargs['model_path']):
+                raise FileNotFoundError(f"{kwargs['model_path']} not found, run prepare_models.py first")
+        session = rembg.new_session(spec.rembg_name, sess_opts=build_session_options(), **kwargs)
+    load_seconds = time.perf_counter() - start
+
+    if Config.MODEL_WARMUP:
+        warm_up(session, spec)
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    logger.info(
+        f"Loaded model '{model_name}' from {source} in {load_seconds:.2f}s, ready after "
+        f"{time.perf_counter() - start:.2f}s (intra_op_threads={default_intra_op_threads()}, batch={batch_dim})"
+    )
+    if isinstance(batch_dim, int):
+        logger.warning(
+            f"Model '{model_name}' takes a fixed batch of {batch_dim}, so batches run {batch_dim} image(s) "
+            f"per inference. Run prepare_models.py {model_name} to build a dynamic-batch copy."
+        )
+    return session
+
+
+def preload_sessions(model_names) -> bool:
+    """Loads sessions in this process so forked workers share them copy-on-write.
+
+    onnxruntime's intra-op thread pool doesn't survive a fork, so this only
+    preloads when sessions run single-threaded (the default when there is one
+    worker per core). Returns whether the models were preloaded.
+    """
+    if default_intra_op_threads() > 1:
+        logger.warning(
+            f"Not preloading models: intra_op_threads={default_intra_op_threads()} is not fork-safe, "
+            f"workers load their own copy"
+        )
+        return False
+    for model_name in model_names:
+        _preloaded_sessions[model_name] = create_session(model_name)
+    return True
+
+
+def preload_for_fork() -> bool:
+    """Preloads REMBG_MODEL before starting workers when PRELOAD_MODEL is on and workers are forked."""
+    if not Config.PRELOAD_MODEL:
+        return False
+    if Config.WORKER_START_METHOD != 'fork':
+        logger.warning(f"PRELOAD_MODEL needs WORKER_START_METHOD=fork (is '{Config.WORKER_START_METHOD}'), not preloading")
+        return False
+    return preload_sessions([Config.REMBG_MODEL])
@@ -1,18 +1,200 @@
 # prepare_models.py
-print("Preparing rembg models by triggering the library's own download mechanism...")
-
-try:
-    # Yeh line rembg ke apne internal downloader (Pooch) ko istemal karegi
-    # taki woh model ko sahi URL se fetch kar sake.
-    from rembg import new_session
-    
-    # Hamare ImageProcessor ko 'u2net' model chahiye.
-    # Iske liye session banane se download apne aap trigger ho jayega.
-    _ = new_session("u2net")
-    
-    print("Model preparation complete. The necessary model should now be cached.")
-
-except Exception as e:
-    print(f"An error occurred during model preparation: {e}")
-    # Agar model taiyar karne me koi error aaye to build fail kar do.
-    exit(1)
+"""Downloads (and quantizes) the rembg models at build time and saves dynamic-batch, pre-optimized ORT-format graphs.
+
+Usage:
+    python prepare_models.py                    # prepare Config.PREPARE_MODELS
+    python prepare_models.py u2net u2netp       # prepare specific tiers
+    python prepare_models.py --report           # also print latency and memory per tier
+"""
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+from config import Config
+from model_registry import (
+    MODEL_SPECS, batched_model_path, build_session_options, create_session, downloaded_model_path,
+    optimized_model_path, quantized_model_path, source_model_path
+)
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB (Linux), 0 if unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def make_batch_dynamic(model_name):
+    """Writes a copy of the tier's graph whose batch dimension is symbolic.
+
+    rembg's exports fix the batch at 1, which turns a batched run into one
+    inference per image. The copy is checked with a batch of 2 and only
+    kept if that works.
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    output_path = batched_model_path(model_name)
+    if os.path.exists(output_path):
+        print(f"Dynamic-batch model already present at {output_path}")
+        return
+    try:
+        import onnx
+    except ImportError:
+        print(f"onnx is not installed, keeping the fixed-batch {model_name} graph (batches will run one image at a time)")
+        return
+
+    model = onnx.load(downloaded_model_path(model_name))
+    model_input = model.graph.input[0]
+    if model_input.type.tensor_type.shape.dim[0].dim_param:
+        print(f"{model_name} already has a dynamic batch dimension")
+        return
+
+    for value in list(model.graph.input) + list(model.graph.output):
+        value.type.tensor_type.shape.dim[0].dim_param = 'batch'
+    # Intermediate shapes were inferred for a batch of 1
+    del model.graph.value_info[:]
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = output_path + '.tmp'
+    onnx.save(model, temp_path)
+    spec = MODEL_SPECS[model_name]
+    try:
+        session = ort.InferenceSession(temp_path, providers=['CPUExecutionProvider'])
+        blank = np.zeros((2, 3, spec.input_size[1], spec.input_size[0]), dtype=np.float32)
+        output = session.run(None, {model_input.name: blank})[0]
+        if output.shape[0] != 2:
+            raise ValueError(f"output batch is {output.shape[0]}")
+    except Exception as e:
+        os.remove(temp_path)
+        print(f"Could not make the batch dimension of {model_name} dynamic, batches will run one image at a time: {e}")
+        return
+    print(f"Wrote {model_name} with a dynamic batch dimension -> {output_path}")
+    os.replace(temp_path, output_path)
+    # A prebuilt .ort from the fixed-batch graph would still take one image per run
+    if os.path.exists(optimized_model_path(model_name)):
+        os.remove(optimized_model_path(model_name))
+
+
+def quantize_u2net():
+    """Writes an int8 (dynamic quantized) copy of u2net next to rembg's models."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_path = quantized_model_path()
+    if os.path.exists(output_path):
+        print(f"Quantized model already present at {output_path}")
+        return
+
+    # Quantized from the dynamic-batch copy, so the int8 tier batches too
+    make_batch_dynamic('u2net')
+    source_path = source_model_path('u2net')
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    print(f"Quantizing {source_path} -> {output_path} ...")
+    quantize_dynamic(source_path, output_path, weight_type=QuantType.QUInt8)
+
+
+def build_optimized_model(model_name):
+    """Saves the tier's graph, optimized at ORT_PREBUILT_OPTIMIZATION, as an ORT-format file.
+
+    The bot then loads that file with graph optimization off instead of
+    optimizing the .onnx model again on every boot.
+    """
+    import onnxruntime as ort
+
+    output_path = optimized_model_path(model_name)
+    if os.path.exists(output_path):
+        print(f"Optimized model already present at {output_path}")
+        return
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = output_path + '.tmp'
+    sess_opts = build_session_options(Config.ORT_PREBUILT_OPTIMIZATION)
+    sess_opts.optimized_model_filepath = temp_path
+    sess_opts.add_session_config_entry('session.save_model_format', 'ORT')
+    print(f"Optimizing {model_name} ({Config.ORT_PREBUILT_OPTIMIZATION}) -> {output_path} ...")
+    ort.InferenceSession(source_model_path(model_name), sess_opts, providers=['CPUExecutionProvider'])
+    # Rename at the end so a half-written file is never picked up
+    os.replace(temp_path, output_path)
+
+
+def prepare(model_name):
+    """Makes sure a model tier is available locally."""
+    if model_name == 'u2net-int8':
+        quantize_u2net()
+    else:
+        make_batch_dynamic(model_name)
+    if Config.ORT_PREBUILT:
+        build_optimized_model(model_name)
+    # Session banane se rembg ka apna downloader (Pooch) model fetch kar leta hai
+    create_session(model_name)
+    print(f"Model '{model_name}' is ready.")
+
+
+def make_sample_photo(width=1600, height=1200):
+    """Synthetic product-like JPEG so the report doesn't need real photos."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (width, height), (235, 235, 230))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width * 0.25, height * 0.15, width * 0.75, height * 0.85), fill=(180, 40, 60))
+    draw.rectangle((width * 0.4, height * 0.05, width * 0.6, height * 0.2), fill=(60, 60, 70))
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def report(models, runs):
+    """Prints load time, per-image latency and memory for each model tier."""
+    from image_processor import ImageProcessor
+
+    sample = make_sample_photo()
+    print(f"\n{'model':<20}{'ready s':>8}{'ms/image':>10}{'+RSS MB':>10}")
+    for model_name in models:
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        processor = ImageProcessor(model_name=model_name)
+        processor.rembg_session  # load + warm-up
+        load_seconds = time.perf_counter() - start
+        if processor.rembg_session is None:
+            print(f"{model_name:<20}{'failed to load':>28}")
+            continue
+
+        processor.remove_background(sample)  # warm-up
+        start = time.perf_counter()
+        for _ in range(runs):
+            processor.remove_background(sample)
+        latency_ms = (time.perf_counter() - start) / runs * 1000
+        print(f"{model_name:<20}{load_seconds:>8.2f}{latency_ms:>10.1f}{current_rss_mb() - rss_before:>10.1f}")
+        del processor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare rembg models for this deployment.")
+    parser.add_argument('models', nargs='*', help=f"Model tiers ({', '.join(MODEL_SPECS)})")
+    parser.add_argument('--report', action='store_true', help="Print latency and memory per tier")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per tier for --report")
+    args = parser.parse_args()
+
+    models = args.models or [name.strip() for name in Config.PREPARE_MODELS.split(',') if name.strip()]
+    print(f"Preparing rembg models: {', '.join(models)}")
+
+    try:
+        for model_name in models:
+            prepare(model_name)
+        print("Model preparation complete. The necessary models should now be cached.")
+    except Exception as e:
+        print(f"An error occurred during model preparation: {e}")
+        # Agar model taiyar karne me koi error aaye to build fail kar do.
+        sys.exit(1)
+
+    if args.report:
+        report(models, args.runs)
+
+
+if __name__ == '__main__':
+    main()
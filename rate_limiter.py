@@ -0,0 +1,153 @@
+# rate_limiter.py
+
+import asyncio
+import datetime
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class FairRateLimiter(BaseRateLimiter):
+    """Shared scheduler for every outgoing Telegram request.
+
+    All requests draw from one global budget (TELEGRAM_GLOBAL_RATE messages
+    per second). Interactive calls (replies to what a user just did) always
+    go first. Bulk calls - marked with rate_limit_args={'bulk': True}, i.e.
+    result albums and progress edits - are additionally limited to one
+    message per TELEGRAM_CHAT_INTERVAL per chat and served round-robin
+    across chats, so one user's 200-image batch can't starve everyone else.
+    An album counts as one message per photo.
+
+    A RetryAfter from Telegram pauses all sending for the requested time,
+    then the request is retried (up to TELEGRAM_MAX_RETRIES times).
+    """
+
+    def __init__(self, global_rate: float = None, chat_interval: float = None, max_retries: int = None):
+        self.global_interval = 1.0 / (global_rate or Config.TELEGRAM_GLOBAL_RATE)
+        self.chat_interval = chat_interval if chat_interval is not None else Config.TELEGRAM_CHAT_INTERVAL
+        self.max_retries = max_retries if max_retries is not None else Config.TELEGRAM_MAX_RETRIES
+
+        self._interactive = deque()  # (future, weight)
+        self._bulk = OrderedDict()  # chat_id -> deque of (future, weight), rotated round-robin
+        self._next_global = 0.0
+        self._chat_next = {}  # chat_id -> earliest time of its next bulk message
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def initialize(self) -> None:
+        self._ensure_dispatcher()
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch(), name='telegram-rate-limiter')
+
+    @staticmethod
+    def _weight(endpoint: str, data: dict) -> int:
+        if endpoint == 'sendMediaGroup':
+            return max(1, len(data.get('media') or ()))
+        return 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        bulk = bool(rate_limit_args and rate_limit_args.get('bulk'))
+        chat_id = data.get('chat_id')
+        weight = self._weight(endpoint, data)
+
+        for attempt in range(self.max_retries + 1):
+            # A retry keeps its place at the head of the line, so results stay in order
+            await self._acquire(chat_id, weight, bulk, retry=attempt > 0)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Telegram flood limit still hit after {self.max_retries} retries ({endpoint})")
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Telegram flood limit on {endpoint}, pausing all sends for {retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after + 0.1)
+        return None
+
+    async def _acquire(self, chat_id, weight: int, bulk: bool, retry: bool = False):
+        """Waits until the dispatcher grants this request its turn."""
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        queue = self._bulk.setdefault(chat_id, deque()) if bulk and chat_id is not None else self._interactive
+        if retry:
+            queue.appendleft((future, weight))
+        else:
+            queue.append((future, weight))
+        self._wakeup.set()
+        await future
+
+    def _next_request(self, now: float):
+        """Picks the next request to grant: interactive first, then bulk round-robin over ready chats.
+
+        Returns (future, weight, chat_id) or (None, earliest time a bulk chat is ready).
+        """
+        while self._interactive:
+            future, weight = self._interactive.popleft()
+            if not future.cancelled():
+                return future, weight, None
+
+        earliest = None
+        for chat_id in list(self._bulk):
+            queue = self._bulk[chat_id]
+            while queue and queue[0][0].cancelled():
+                queue.popleft()
+            if not queue:
+                del self._bulk[chat_id]
+                continue
+            ready_at = self._chat_next.get(chat_id, 0.0)
+            if ready_at <= now:
+                future, weight = queue.popleft()
+                # Served - this chat goes to the back of the line
+                self._bulk.move_to_end(chat_id)
+                return future, weight, chat_id
+            earliest = ready_at if earliest is None else min(earliest, ready_at)
+        return None, earliest
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            wait = max(self._next_global, self._paused_until) - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            picked = self._next_request(now)
+            if picked[0] is None:
+                earliest = picked[1]
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if earliest is None else earliest - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            future, weight, chat_id = picked
+            future.set_result(None)
+            self._next_global = now + self.global_interval * weight
+            if chat_id is not None:
+                self._chat_next[chat_id] = now + self.chat_interval * weight
+                if not self._bulk.get(chat_id):
+                    # Chats with nothing queued only need their pacing until it has passed
+                    self._prune_chats(now)
+
+    def _prune_chats(self, now: float):
+        for chat_id in [c for c, ready_at in self._chat_next.items() if ready_at <= now and not self._bulk.get(c)]:
+            del self._chat_next[chat_id]
@@ -0,0 +1,175 @@
+# scheduler.py
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Worker methods that make up the per-image cost of a batch (used for ETAs)
+REMOVAL_METHODS = ('remove_background_batch', 'remove_background')
+COMPOSE_METHODS = ('render_sizes', 'compose_on_template')
+
+
+class FairScheduler:
+    """Round-robin queue between BotHandler and the WorkerPool.
+
+    Tasks are queued per user and handed to the pool one user at a time, so
+    a 200-image batch interleaves with everyone else's work instead of
+    sitting in front of it. At most SCHEDULER_MAX_IN_FLIGHT tasks (default:
+    one per worker) run at once, and at most USER_MAX_IN_FLIGHT per user.
+    Background tasks (speculative cutouts) are only picked when no
+    foreground task can start, until the user's batch needs them (promote).
+
+    The scheduler also tracks each user's outstanding batch images, which
+    drives backpressure (QUEUE_MAX_IMAGES, UPLOAD_BACKLOG_LIMIT) and the
+    "you are #N in the queue" estimate.
+    """
+
+    def __init__(self, worker_pool, max_in_flight: int = None, user_max_in_flight: int = None):
+        self.worker_pool = worker_pool
+        self.max_in_flight = max_in_flight or Config.SCHEDULER_MAX_IN_FLIGHT or worker_pool.max_workers
+        self.user_max_in_flight = user_max_in_flight or Config.USER_MAX_IN_FLIGHT
+
+        self._queues = {False: OrderedDict(), True: OrderedDict()}  # background? -> user_id -> deque of tasks
+        self._in_flight = {}  # user_id -> running tasks
+        self._total_in_flight = 0
+        self._outstanding = {}  # user_id -> batch images not finished yet
+        self._unit_seconds = {}  # method -> EWMA of worker seconds per image
+
+        metrics.REGISTRY.gauge('bot_scheduler_backlog_images', 'Batch images accepted and not finished yet.').set_function(
+            self.backlog
+        )
+        metrics.REGISTRY.gauge('bot_scheduler_queued_tasks', 'Worker tasks waiting in the fair scheduler.').set_function(
+            self.queued_tasks
+        )
+
+    async def submit(self, user_id, method_name: str, *args, cost: int = 1, background: bool = False, **kwargs):
+        """Queues `ImageProcessor.<method_name>(*args, **kwargs)` for `user_id` and awaits its result.
+
+        `cost` is the number of images the task covers.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queues[background].setdefault(user_id, deque()).append((future, method_name, args, kwargs, cost))
+        self._pump()
+        return await future
+
+    def promote(self, user_id):
+        """Moves the user's queued background tasks to the front of their foreground queue.
+
+        A batch awaits the user's speculative cutouts; left in the background
+        they would wait for everyone else's foreground work first.
+        """
+        queue = self._queues[True].pop(user_id, None)
+        if not queue:
+            return
+        self._queues[False].setdefault(user_id, deque()).extendleft(reversed(queue))
+        logger.info(f"Promoted {len(queue)} background tasks of user {user_id} to foreground")
+        self._pump()
+
+    def _next_task(self):
+        """Next task to start: foreground before background, users in round-robin order."""
+        for background in (False, True):
+            queues = self._queues[background]
+            for user_id in list(queues):
+                queue = queues[user_id]
+                while queue and queue[0][0].cancelled():
+                    queue.popleft()
+                if not queue:
+                    del queues[user_id]
+                    continue
+                if self._in_flight.get(user_id, 0) >= self.user_max_in_flight:
+                    continue
+                task = queue.popleft()
+                # Served - this user goes to the back of the line
+                queues.move_to_end(user_id)
+                return user_id, task
+        return None
+
+    def _pump(self):
+        while self._total_in_flight < self.max_in_flight:
+            picked = self._next_task()
+            if picked is None:
+                return
+            user_id, task = picked
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+            self._total_in_flight += 1
+            asyncio.create_task(self._run(user_id, *task))
+
+    async def _run(self, user_id, future, method_name, args, kwargs, cost):
+        start = time.perf_counter()
+        try:
+            result = await self.worker_pool.submit(method_name, *args, **kwargs)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self._record_duration(method_name, time.perf_counter() - start, cost)
+            self._total_in_flight -= 1
+            remaining = self._in_flight[user_id] - 1
+            if remaining:
+                self._in_flight[user_id] = remaining
+            else:
+                del self._in_flight[user_id]
+            self._pump()
+
+    def _record_duration(self, method_name: str, seconds: float, cost: int):
+        per_image = seconds / max(cost, 1)
+        previous = self._unit_seconds.get(method_name)
+        self._unit_seconds[method_name] = per_image if previous is None else 0.8 * previous + 0.2 * per_image
+
+    # -- Batch bookkeeping (backpressure and ETAs) --
+
+    def reserve(self, user_id, images: int):
+        """Counts a newly started batch towards the backlog."""
+        self._outstanding[user_id] = self._outstanding.get(user_id, 0) + images
+
+    def release(self, user_id, images: int = 1):
+        """Marks batch images as finished (processed or failed)."""
+        remaining = self._outstanding.get(user_id, 0) - images
+        if remaining > 0:
+            self._outstanding[user_id] = remaining
+        else:
+            self._outstanding.pop(user_id, None)
+
+    def backlog(self) -> int:
+        """Batch images accepted and not finished yet, across all users."""
+        return sum(self._outstanding.values())
+
+    def queued_tasks(self) -> int:
+        return sum(len(queue) for queues in self._queues.values() for queue in queues.values())
+
+    def can_accept_batch(self, images: int) -> bool:
+        """Global cap: a new batch must fit under QUEUE_MAX_IMAGES (an idle bot always takes one)."""
+        backlog = self.backlog()
+        return backlog == 0 or backlog + images <= Config.QUEUE_MAX_IMAGES
+
+    def accepts_uploads(self) -> bool:
+        return self.backlog() < Config.UPLOAD_BACKLOG_LIMIT
+
+    def seconds_per_image(self) -> float:
+        """Worker seconds one batch image costs, from recent runs."""
+        removal = next((self._unit_seconds[m] for m in REMOVAL_METHODS if m in self._unit_seconds), None)
+        compose = next((self._unit_seconds[m] for m in COMPOSE_METHODS if m in self._unit_seconds), None)
+        if removal is None and compose is None:
+            return Config.ETA_SECONDS_PER_IMAGE
+        return (removal or 0.0) + (compose or 0.0)
+
+    def queue_position(self, user_id, images: int) -> tuple:
+        """(position, eta_seconds) for a batch of `images` about to start for `user_id`.
+
+        With round-robin, every other busy user delays this batch by at most
+        as many images as the batch itself has, so that is what the ETA counts.
+        """
+        others = {uid: count for uid, count in self._outstanding.items() if uid != user_id}
+        share = images + sum(min(count, images) for count in others.values())
+        workers = max(1, min(self.max_in_flight, self.worker_pool.max_workers))
+        eta = math.ceil(share * self.seconds_per_image() / workers)
+        return len(others) + 1, eta
@@ -1,7 +1,11 @@
 # session_manager.py
 
+import hashlib
 import logging
+import threading
+import time
 import redis
+import redis.asyncio
 import json
 from typing import Optional
 
@@ -9,20 +13,67 @@ from config import Config
 
 logger = logging.getLogger(__name__)
 
+# One connection pool per decode mode, shared by everything in this process
+_connection_pools = {}
+_pools_lock = threading.Lock()
+
+# Per-template reference counts and stored sizes (hash fields keyed by content hash)
+TEMPLATE_REFCOUNTS_KEY = "templates:refcounts"
+TEMPLATE_SIZES_KEY = "templates:sizes"
+# user_id -> time of the user's last activity; the reaper evicts from the oldest end
+ACTIVITY_KEY = "sessions:activity"
+# Session hash fields that are user choices rather than progress, so they survive /start
+PREFERENCE_FIELDS = ('model', 'format')
+
+# Refreshes the TTL of the template the session points at; the blob key is only
+# known once the session hash has been read, so this has to run inside Redis
+TOUCH_TEMPLATE_SCRIPT = """
+local template_hash = redis.call('HGET', KEYS[1], 'template')
+if template_hash then
+    redis.call('EXPIRE', 'template:' .. template_hash, ARGV[1])
+end
+return 0
+"""
+
+
+def get_redis_client(decode_responses: bool = True) -> redis.Redis:
+    """Returns a Redis client backed by the process-wide connection pool."""
+    with _pools_lock:
+        pool = _connection_pools.get(decode_responses)
+        if pool is None:
+            pool = redis.ConnectionPool.from_url(Config.REDIS_URL, decode_responses=decode_responses)
+            _connection_pools[decode_responses] = pool
+    return redis.Redis(connection_pool=pool)
+
+
+def get_async_redis_client(decode_responses: bool = True) -> redis.asyncio.Redis:
+    """Returns an asyncio Redis client (its pool connects lazily, on the running loop)."""
+    return redis.asyncio.from_url(Config.REDIS_URL, decode_responses=decode_responses)
+
+
 class SessionManager:
     def __init__(self):
-        """Initialize session manager with Redis connection."""
+        """Initialize session manager with pooled Redis clients."""
         if not Config.REDIS_URL:
             raise ValueError("REDIS_URL not configured in environment variables.")
         
         try:
-            self.redis_client = redis.from_url(Config.REDIS_URL, decode_responses=True)
+            self.redis_client = get_redis_client(decode_responses=True)
             self.redis_client.ping()
+            # Binary values (templates, images, cutouts) need a client that doesn't decode responses
+            self.redis_bytes_client = get_redis_client(decode_responses=False)
             logger.info("Successfully connected to Redis.")
         except redis.exceptions.ConnectionError as e:
             logger.error(f"Could not connect to Redis: {e}")
             raise
 
+        # Optional asyncio clients so the hot-path handler calls don't block the event loop
+        self.async_redis_client = None
+        self.async_redis_bytes_client = None
+        if Config.REDIS_ASYNC:
+            self.async_redis_client = get_async_redis_client(decode_responses=True)
+            self.async_redis_bytes_client = get_async_redis_client(decode_responses=False)
+
     def _get_user_key(self, user_id: int) -> str:
         """Generates the main key for a user's session hash."""
         return f"user:{user_id}"
@@ -31,45 +82,337 @@ class SessionManager:
         """Generates the key for a user's pending images list."""
         return f"user:{user_id}:pending_images"
 
-    def _get_template_key(self, user_id: int) -> str:
-        """Generates the key for storing user's template image data."""
-        return f"template:{user_id}"
+    def _get_pending_data_key(self, user_id: int) -> str:
+        """Generates the key of the hash holding the raw bytes of a user's pending images (field = image key).
+
+        One key for all of them, so activity refreshes their TTL together with the list's.
+        """
+        return f"user:{user_id}:pending_data"
+
+    def _get_template_blob_key(self, template_hash: str) -> str:
+        """Generates the content-addressed key holding one template's bytes."""
+        return f"template:{template_hash}"
+
+    def _get_cutout_key(self, cache_key: str) -> str:
+        """Generates the key for a cached background-removed cutout."""
+        return f"cutout:{cache_key}"
+
+    @staticmethod
+    def _reaper_margin() -> int:
+        """How long keys outlive the reaper's idle limits.
+
+        The reaper has to see a session before Redis expires it - it needs the
+        template hash to release the template. A user can cross a limit just
+        after a sweep, so two sweep intervals are always enough.
+        """
+        return 2 * max(Config.REAPER_INTERVAL, 0)
+
+    @classmethod
+    def _session_ttl(cls) -> int:
+        """Redis TTL of the session hash."""
+        return Config.SESSION_TTL + cls._reaper_margin()
+
+    @classmethod
+    def _pending_ttl(cls) -> int:
+        """Redis TTL of pending images."""
+        return Config.PENDING_IMAGES_TTL + cls._reaper_margin()
+
+    def _queue_touch(self, pipe, user_id: int):
+        """Refreshes the idle TTLs of the user's session keys and template, and records the activity for the reaper."""
+        now = time.time()
+        pipe.expire(self._get_user_key(user_id), self._session_ttl())
+        pipe.expire(self._get_pending_images_key(user_id), self._pending_ttl())
+        pipe.expire(self._get_pending_data_key(user_id), self._pending_ttl())
+        pipe.eval(TOUCH_TEMPLATE_SCRIPT, 1, self._get_user_key(user_id), Config.TEMPLATE_TTL)
+        pipe.zadd(ACTIVITY_KEY, {user_id: now})
+        # Entries of sessions Redis has already expired, in case the reaper is off
+        pipe.zremrangebyscore(ACTIVITY_KEY, '-inf', now - self._session_ttl())
+
+    def _set_session_fields(self, user_id: int, **fields):
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(self._get_user_key(user_id), mapping=fields)
+        self._queue_touch(pipe, user_id)
+        pipe.execute()
 
     def set_user_state(self, user_id: int, state: str):
         """Set user state in Redis hash."""
-        self.redis_client.hset(self._get_user_key(user_id), 'state', state)
+        self._set_session_fields(user_id, state=state)
 
     def get_user_state(self, user_id: int) -> Optional[str]:
         """Get user state from Redis hash."""
         return self.redis_client.hget(self._get_user_key(user_id), 'state')
 
-    def set_template(self, user_id: int, template_data: bytes):
-        """Set user template data in Redis."""
-        # Template data is stored as bytes, not string
-        self.redis_client.set(self._get_template_key(user_id), template_data)
+    def get_session_fields(self, user_id: int, *fields: str) -> dict:
+        """Get several session hash fields (e.g. state and model) in one round trip.
+
+        Every incoming message reads its session this way, so this also keeps it alive.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hmget(self._get_user_key(user_id), fields)
+        self._queue_touch(pipe, user_id)
+        values = pipe.execute()[0]
+        return dict(zip(fields, values))
+
+    async def get_session_fields_async(self, user_id: int, *fields: str) -> dict:
+        """Async get_session_fields; falls back to the blocking client when async Redis is off."""
+        if self.async_redis_client is None:
+            return self.get_session_fields(user_id, *fields)
+        pipe = self.async_redis_client.pipeline(transaction=False)
+        pipe.hmget(self._get_user_key(user_id), fields)
+        self._queue_touch(pipe, user_id)
+        values = (await pipe.execute())[0]
+        return dict(zip(fields, values))
+
+    @staticmethod
+    def hash_template(template_data: bytes) -> str:
+        """Content hash templates are stored under (same as TemplateCache.hash_template)."""
+        return hashlib.sha256(template_data).hexdigest()
+
+    def set_template(self, user_id: int, template_data: bytes, state: Optional[str] = None) -> str:
+        """Stores a template and points the user's session at it, optionally moving the user to `state`.
+
+        Templates are content-addressed, so users sharing a template share one
+        blob. Returns the template hash.
+        """
+        template_hash = self.hash_template(template_data)
+        user_key = self._get_user_key(user_id)
+        blob_key = self._get_template_blob_key(template_hash)
+
+        pipe = self.redis_bytes_client.pipeline()
+        pipe.hget(user_key, 'template')
+        pipe.exists(blob_key)
+        old_hash, blob_exists = pipe.execute()
+        old_hash = old_hash.decode() if old_hash else None
+
+        pipe = self.redis_bytes_client.pipeline(transaction=True)
+        if blob_exists:
+            # Already stored by someone else - don't send the bytes again
+            pipe.expire(blob_key, Config.TEMPLATE_TTL)
+        else:
+            pipe.set(blob_key, template_data, ex=Config.TEMPLATE_TTL)
+        if old_hash != template_hash:
+            pipe.hincrby(TEMPLATE_REFCOUNTS_KEY, template_hash, 1)
+            pipe.hset(TEMPLATE_SIZES_KEY, template_hash, len(template_data))
+        fields = {'template': template_hash}
+        if state:
+            fields['state'] = state
+        pipe.hset(user_key, mapping=fields)
+        self._queue_touch(pipe, user_id)
+        stored = pipe.execute()[0]
+
+        if not stored:
+            # The blob expired between the check and the transaction. Stats may have
+            # forgotten the hash meanwhile (blob gone), so make sure it's counted again
+            pipe = self.redis_bytes_client.pipeline(transaction=True)
+            pipe.set(blob_key, template_data, ex=Config.TEMPLATE_TTL)
+            pipe.hsetnx(TEMPLATE_REFCOUNTS_KEY, template_hash, 1)
+            pipe.hset(TEMPLATE_SIZES_KEY, template_hash, len(template_data))
+            pipe.execute()
+        if old_hash and old_hash != template_hash:
+            self._release_template(old_hash)
+        return template_hash
+
+    def _release_template(self, template_hash: str):
+        """Drops one reference to a template.
+
+        The blob itself is never deleted here; once nobody reads it, it expires
+        on its idle TTL. That way a user re-uploading the same template in the
+        meantime can't lose it to a concurrent delete.
+        """
+        self.redis_client.hincrby(TEMPLATE_REFCOUNTS_KEY, template_hash, -1)
+
+    def _read_template_blob(self, template_hash: Optional[str]) -> Optional[bytes]:
+        """Reads a template blob and refreshes its idle TTL in the same round trip."""
+        if not template_hash:
+            return None
+        blob_key = self._get_template_blob_key(template_hash)
+        pipe = self.redis_bytes_client.pipeline(transaction=False)
+        pipe.get(blob_key)
+        pipe.expire(blob_key, Config.TEMPLATE_TTL)
+        return pipe.execute()[0]
+
+    def get_template_hash(self, user_id: int) -> Optional[str]:
+        """Content hash of the user's current template."""
+        return self.redis_client.hget(self._get_user_key(user_id), 'template')
 
     def get_template(self, user_id: int) -> Optional[bytes]:
         """Get user template data from Redis."""
-        # Note: decode_responses=True doesn't apply to raw .get() for bytes
-        redis_bytes_client = redis.from_url(Config.REDIS_URL)
-        return redis_bytes_client.get(self._get_template_key(user_id))
+        return self._read_template_blob(self.get_template_hash(user_id))
+
+    def get_template_stats(self) -> dict:
+        """Template storage totals: unique blobs, references and the bytes dedup saves.
+
+        Only templates whose blob still exists are counted. Entries whose blob
+        has expired are forgotten here, whatever their reference count - a
+        session that expired on its TTL never released its reference.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(TEMPLATE_REFCOUNTS_KEY)
+        pipe.hgetall(TEMPLATE_SIZES_KEY)
+        refcounts, sizes = pipe.execute()
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for template_hash in refcounts:
+            pipe.exists(self._get_template_blob_key(template_hash))
+        blob_exists = dict(zip(refcounts, pipe.execute()))
+
+        stats = {'templates': 0, 'references': 0, 'stored_bytes': 0, 'logical_bytes': 0}
+        expired = []
+        for template_hash, count in refcounts.items():
+            count, size = int(count), int(sizes.get(template_hash, 0))
+            if not blob_exists[template_hash]:
+                expired.append(template_hash)
+                continue
+            if count <= 0:
+                continue  # unreferenced, ages out on TEMPLATE_TTL
+            stats['templates'] += 1
+            stats['references'] += count
+            stats['stored_bytes'] += size
+            stats['logical_bytes'] += size * count
+        stats['saved_bytes'] = stats['logical_bytes'] - stats['stored_bytes']
+
+        if expired:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hdel(TEMPLATE_REFCOUNTS_KEY, *expired)
+            pipe.hdel(TEMPLATE_SIZES_KEY, *expired)
+            pipe.execute()
+        return stats
+
+    def delete_legacy_templates(self) -> int:
+        """Deletes per-user template:{user_id} blobs from before templates were content-addressed.
+
+        Nothing reads them any more and they were stored without a TTL.
+        Returns the bytes freed.
+        """
+        legacy = [
+            key for key in self.redis_client.scan_iter(match='template:*', count=1000)
+            if key.split(':', 1)[1].isdigit()
+        ]
+        if not legacy:
+            return 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in legacy:
+            pipe.strlen(key)
+        freed = sum(pipe.execute())
+        self.redis_client.delete(*legacy)
+        logger.info(f"Deleted {len(legacy)} legacy per-user template blobs ({freed} bytes)")
+        return freed
+
+    def get_cutout(self, cache_key: str) -> Optional[bytes]:
+        """Get an encoded cutout from the shared cutout cache."""
+        return self.redis_bytes_client.get(self._get_cutout_key(cache_key))
 
-    def add_pending_image(self, user_id: int, image_path: str):
-        """Add an image path to the user's pending images list in Redis."""
-        self.redis_client.rpush(self._get_pending_images_key(user_id), image_path)
+    def set_cutout(self, cache_key: str, cutout_data: bytes, ttl: int):
+        """Store an encoded cutout in the shared cutout cache with a TTL in seconds."""
+        self.redis_bytes_client.set(self._get_cutout_key(cache_key), cutout_data, ex=ttl)
+
+    def get_template_ref(self, user_id: int) -> Optional[str]:
+        """Reference to the user's current template that workers can resolve with get_template_by_ref.
+
+        The reference is the content hash, so it keeps pointing at the same
+        bytes even if the user sets a new template while a job is queued.
+        """
+        return self.get_template_hash(user_id)
+
+    def get_template_by_ref(self, template_ref: str) -> Optional[bytes]:
+        """Get template data from a reference returned by get_template_ref."""
+        return self._read_template_blob(template_ref)
+
+    def _queue_collect_image(self, pipe, user_id: int, image_key: str, image_data: bytes):
+        pipe.hset(self._get_pending_data_key(user_id), image_key, image_data)
+        pipe.rpush(self._get_pending_images_key(user_id), image_key)
+        pipe.hset(self._get_user_key(user_id), 'state', 'collecting_images')
+        self._queue_touch(pipe, user_id)
+
+    def add_pending_image(self, user_id: int, image_key: str, image_data: bytes) -> int:
+        """Store an image, append it to the pending list and set state 'collecting_images'.
+
+        Runs as one MULTI round trip and returns the new number of pending images.
+        """
+        pipe = self.redis_bytes_client.pipeline(transaction=True)
+        self._queue_collect_image(pipe, user_id, image_key, image_data)
+        return pipe.execute()[1]
+
+    async def add_pending_image_async(self, user_id: int, image_key: str, image_data: bytes) -> int:
+        """Async add_pending_image; falls back to the blocking client when async Redis is off."""
+        if self.async_redis_bytes_client is None:
+            return self.add_pending_image(user_id, image_key, image_data)
+        pipe = self.async_redis_bytes_client.pipeline(transaction=True)
+        self._queue_collect_image(pipe, user_id, image_key, image_data)
+        return (await pipe.execute())[1]
+
+    def _queue_begin_dimensions(self, pipe, user_id: int):
+        pipe.llen(self._get_pending_images_key(user_id))
+        pipe.hset(self._get_user_key(user_id), 'state', 'waiting_for_dimensions')
+        self._queue_touch(pipe, user_id)
+
+    def begin_dimensions(self, user_id: int) -> int:
+        """Moves the user to 'waiting_for_dimensions' and returns the pending image count.
+
+        With nothing pending the user goes back to 'template_set' instead.
+        """
+        pipe = self.redis_client.pipeline(transaction=True)
+        self._queue_begin_dimensions(pipe, user_id)
+        count = pipe.execute()[0]
+        if not count:
+            self.set_user_state(user_id, 'template_set')
+        return count
+
+    async def begin_dimensions_async(self, user_id: int) -> int:
+        """Async begin_dimensions; falls back to the blocking client when async Redis is off."""
+        if self.async_redis_client is None:
+            return self.begin_dimensions(user_id)
+        pipe = self.async_redis_client.pipeline(transaction=True)
+        self._queue_begin_dimensions(pipe, user_id)
+        count = (await pipe.execute())[0]
+        if not count:
+            await self.async_redis_client.hset(self._get_user_key(user_id), 'state', 'template_set')
+        return count
 
     def get_pending_images(self, user_id: int) -> list:
-        """Get list of pending image paths from Redis."""
+        """Get list of pending image keys from Redis."""
         return self.redis_client.lrange(self._get_pending_images_key(user_id), 0, -1)
 
+    def get_pending_image_data(self, user_id: int, image_key: str) -> Optional[bytes]:
+        """Get the raw bytes of a pending image."""
+        return self.redis_bytes_client.hget(self._get_pending_data_key(user_id), image_key)
+
     def clear_pending_images(self, user_id: int):
-        """Clear the pending images list from Redis."""
-        self.redis_client.delete(self._get_pending_images_key(user_id))
+        """Clear the pending images list and their stored bytes from Redis."""
+        self.redis_client.delete(self._get_pending_images_key(user_id), self._get_pending_data_key(user_id))
+
+    def start_batch(self, user_id: int, sizes: list) -> tuple:
+        """Saves the requested (width, height) sizes and returns (pending image keys, template data, template hash)."""
+        width, height = sizes[0]
+        dims = json.dumps({'width': width, 'height': height, 'sizes': [list(size) for size in sizes]})
+        user_key = self._get_user_key(user_id)
+        pipe = self.redis_bytes_client.pipeline(transaction=True)
+        pipe.hset(user_key, 'dimensions', dims)
+        pipe.lrange(self._get_pending_images_key(user_id), 0, -1)
+        pipe.hget(user_key, 'template')
+        self._queue_touch(pipe, user_id)
+        _, image_keys, template_hash, *_ = pipe.execute()
+        template_hash = template_hash.decode() if template_hash else None
+        template_data = self._read_template_blob(template_hash)
+        return [image_key.decode() for image_key in image_keys], template_data, template_hash
+
+    def finish_batch(self, user_id: int, image_keys: list):
+        """Drops the processed images and moves the user back to 'template_set' in one transaction.
+
+        Images uploaded while the batch was running stay pending for the next one.
+        """
+        pipe = self.redis_client.pipeline(transaction=True)
+        if image_keys:
+            pipe.hdel(self._get_pending_data_key(user_id), *set(image_keys))
+        pipe.ltrim(self._get_pending_images_key(user_id), len(image_keys), -1)
+        pipe.hset(self._get_user_key(user_id), 'state', 'template_set')
+        self._queue_touch(pipe, user_id)
+        pipe.execute()
 
     def set_dimensions(self, user_id: int, width: int, height: int):
         """Set target dimensions in user's session hash."""
         dims = json.dumps({'width': width, 'height': height})
-        self.redis_client.hset(self._get_user_key(user_id), 'dimensions', dims)
+        self._set_session_fields(user_id, dimensions=dims)
 
     def get_dimensions(self, user_id: int) -> Optional[tuple]:
         """Get target dimensions from user's session hash."""
@@ -79,16 +422,175 @@ class SessionManager:
             return dims.get('width'), dims.get('height')
         return None, None
 
-    def reset_session(self, user_id: int):
-        """Reset user session by deleting all related keys from Redis."""
+    def set_model(self, user_id: int, model_name: str):
+        """Set the user's background removal model tier."""
+        self._set_session_fields(user_id, model=model_name)
+
+    def get_model(self, user_id: int) -> Optional[str]:
+        """Get the user's model tier, None means the deployment default."""
+        return self.redis_client.hget(self._get_user_key(user_id), 'model')
+
+    def set_output_format(self, user_id: int, output_format: str):
+        """Set the user's result format (JPEG, WEBP or PNG)."""
+        self._set_session_fields(user_id, format=output_format)
+
+    def get_output_format(self, user_id: int) -> Optional[str]:
+        """Get the user's result format, None means the deployment default."""
+        return self.redis_client.hget(self._get_user_key(user_id), 'format')
+
+    def reset_session(self, user_id: int, state: Optional[str] = None):
+        """Reset user session by deleting all related keys from Redis, optionally starting in `state`.
+
+        With a `state` (e.g. /start) the user's /model and /format choices are kept.
+        """
+        *preference_values, template_hash = self.redis_client.hmget(
+            self._get_user_key(user_id), PREFERENCE_FIELDS + ('template',)
+        )
+        preferences = {field: value for field, value in zip(PREFERENCE_FIELDS, preference_values) if value}
+
         keys_to_delete = [
             self._get_user_key(user_id),
             self._get_pending_images_key(user_id),
-            self._get_template_key(user_id)
+            self._get_pending_data_key(user_id),
         ]
         # Use a pipeline to delete keys atomically
         pipe = self.redis_client.pipeline()
         for key in keys_to_delete:
             pipe.delete(key)
+        if state:
+            pipe.hset(self._get_user_key(user_id), mapping={**preferences, 'state': state})
+            self._queue_touch(pipe, user_id)
+        else:
+            pipe.zrem(ACTIVITY_KEY, user_id)
         pipe.execute()
+        if template_hash:
+            self._release_template(template_hash)
         logger.info(f"Session reset for user {user_id}")
+
+    # -- Reclaiming (used by SessionReaper) --
+
+    def get_users_by_activity(self, idle_seconds: float = 0) -> list:
+        """(user_id, last activity time) of users idle for at least `idle_seconds`, least recently active first."""
+        users = self.redis_client.zrangebyscore(ACTIVITY_KEY, '-inf', time.time() - idle_seconds, withscores=True)
+        return [(int(user_id), last_active) for user_id, last_active in users]
+
+    def expire_legacy_keys(self) -> int:
+        """Gives session keys written before idle TTLs existed a TTL. Returns how many were fixed.
+
+        Pending images stored one key per image are moved into the user's pending data hash first.
+        """
+        for key in self.redis_client.scan_iter(match='user:*:pending_image:*', count=1000):
+            _, user_id, _, image_key = key.split(':', 3)
+            image_data = self.redis_bytes_client.get(key)
+            pipe = self.redis_bytes_client.pipeline(transaction=True)
+            if image_data is not None:
+                pipe.hsetnx(self._get_pending_data_key(int(user_id)), image_key, image_data)
+            pipe.delete(key)
+            pipe.execute()
+
+        keys = list(self.redis_client.scan_iter(match='user:*', count=1000))
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+        legacy = [key for key, ttl in zip(keys, pipe.execute()) if ttl == -1]
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in legacy:
+            # user:<id> is the session hash, everything below it is pending images
+            pipe.expire(key, self._session_ttl() if key.count(':') == 1 else self._pending_ttl())
+        pipe.execute()
+        return len(legacy)
+
+    def get_pending_bytes(self, user_ids: list) -> dict:
+        """Bytes of pending images per user, for the users in `user_ids` that have any pending."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.lrange(self._get_pending_images_key(user_id), 0, -1)
+        pending = {user_id: set(image_keys) for user_id, image_keys in zip(user_ids, pipe.execute()) if image_keys}
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id, image_keys in pending.items():
+            for image_key in image_keys:
+                pipe.hstrlen(self._get_pending_data_key(user_id), image_key)
+        sizes = iter(pipe.execute())
+        return {user_id: sum(next(sizes) for _ in image_keys) for user_id, image_keys in pending.items()}
+
+    def get_template_bytes(self) -> int:
+        """Bytes of all stored template blobs, referenced or not."""
+        template_hashes = self.redis_client.hkeys(TEMPLATE_SIZES_KEY)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for template_hash in template_hashes:
+            pipe.strlen(self._get_template_blob_key(template_hash))
+        return sum(pipe.execute())
+
+    def reap_session(self, user_id: int, idle_before: float, whole: bool = False) -> Optional[tuple]:
+        """Drops the pending images of a user idle since `idle_before`; with `whole`, the entire session.
+
+        The user's keys are watched, so if the user does anything in the
+        meantime nothing is dropped and None is returned. Otherwise returns
+        (pending image bytes, template bytes) freed - a template is only freed
+        once no other session uses it.
+        """
+        user_key = self._get_user_key(user_id)
+        pending_key = self._get_pending_images_key(user_id)
+        data_key = self._get_pending_data_key(user_id)
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(user_key, pending_key, data_key)
+                last_active = pipe.zscore(ACTIVITY_KEY, user_id)
+                if last_active is not None and last_active > idle_before:
+                    return None
+                image_keys = pipe.hkeys(data_key)
+                state, template_hash = pipe.hmget(user_key, ('state', 'template'))
+                sizes = self.redis_client.pipeline(transaction=False)
+                for image_key in image_keys:
+                    sizes.hstrlen(data_key, image_key)
+                pending_bytes = sum(sizes.execute())
+
+                pipe.multi()
+                pipe.delete(pending_key, data_key)
+                if whole:
+                    pipe.delete(user_key)
+                    pipe.zrem(ACTIVITY_KEY, user_id)
+                elif state in ('collecting_images', 'waiting_for_dimensions'):
+                    pipe.hset(user_key, 'state', 'template_set')
+                pipe.execute()
+            except redis.WatchError:
+                return None
+
+        template_bytes = 0
+        if whole and template_hash:
+            self._release_template(template_hash)
+            template_bytes = self.delete_unreferenced_templates([template_hash])
+        return pending_bytes, template_bytes
+
+    def delete_unreferenced_templates(self, template_hashes: list = None) -> int:
+        """Deletes template blobs (all, or those in `template_hashes`) that no session references.
+
+        Such blobs would expire on TEMPLATE_TTL anyway; this frees them now.
+        The reference counts are watched, so a template someone picks up again
+        meanwhile is kept (and the next sweep tries again). Returns the bytes freed.
+        """
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(TEMPLATE_REFCOUNTS_KEY)
+                if template_hashes is None:
+                    refcounts = pipe.hgetall(TEMPLATE_REFCOUNTS_KEY)
+                else:
+                    refcounts = dict(zip(template_hashes, pipe.hmget(TEMPLATE_REFCOUNTS_KEY, template_hashes)))
+                unreferenced = [h for h, count in refcounts.items() if count is not None and int(count) <= 0]
+                if not unreferenced:
+                    return 0
+                sizes = self.redis_client.pipeline(transaction=False)
+                for template_hash in unreferenced:
+                    sizes.strlen(self._get_template_blob_key(template_hash))
+                freed = sum(sizes.execute())
+
+                pipe.multi()
+                pipe.delete(*[self._get_template_blob_key(h) for h in unreferenced])
+                pipe.hdel(TEMPLATE_REFCOUNTS_KEY, *unreferenced)
+                pipe.hdel(TEMPLATE_SIZES_KEY, *unreferenced)
+                pipe.execute()
+                return freed
+            except redis.WatchError:
+                return 0
@@ -0,0 +1,168 @@
+# session_reaper.py
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+RECLAIM_KINDS = ('pending_images', 'templates', 'temp_files')
+
+
+class SessionReaper:
+    """Background sweeper that keeps sessions and temp files within their limits.
+
+    Every REAPER_INTERVAL seconds it:
+
+    - removes sessions idle for SESSION_TTL, releasing their templates,
+    - drops pending images of users idle for PENDING_IMAGES_TTL (uploaded,
+      but never said 'done'),
+    - evicts the least recently active sessions while pending images and
+      templates exceed SESSION_MEMORY_BUDGET_MB,
+    - deletes files in TEMP_DIR older than TEMP_FILE_TTL, and the oldest
+      ones while the directory exceeds TEMP_DIR_BUDGET_MB.
+
+    Sessions, pending images and template blobs also expire on their own
+    idle TTLs, so those don't pile up while the reaper is off; the reaper
+    just gets there first and counts what it frees. The template bookkeeping
+    in templates:refcounts / templates:sizes (one small field per template)
+    has no TTL: it shrinks when the reaper deletes unreferenced templates or
+    /stats forgets the ones whose blob has expired.
+    """
+
+    def __init__(self, session_manager, interval: int = None):
+        self.session_manager = session_manager
+        self.interval = interval if interval is not None else Config.REAPER_INTERVAL
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts sweeping in a daemon thread (the Redis calls are blocking, so not on the event loop)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='session-reaper', daemon=True)
+        self._thread.start()
+        logger.info(f"Session reaper started, sweeping every {self.interval}s")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        try:
+            fixed = self.session_manager.expire_legacy_keys()
+            if fixed:
+                logger.info(f"Set idle TTLs on {fixed} session keys that had none")
+        except Exception as e:
+            logger.error(f"Could not check session keys for missing TTLs: {e}")
+        try:
+            metrics.RECLAIMED_BYTES.inc(self.session_manager.delete_legacy_templates(), kind='templates')
+        except Exception as e:
+            logger.error(f"Could not delete legacy template blobs: {e}")
+
+        while not self._stop_event.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Session reaper sweep failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def sweep(self) -> dict:
+        """Runs one pass. Returns the bytes reclaimed by kind."""
+        reclaimed = dict.fromkeys(RECLAIM_KINDS, 0)
+        evicted = {'idle': 0, 'budget': 0}
+        self._reap_idle(reclaimed, evicted)
+        self._enforce_budget(reclaimed, evicted)
+        self._sweep_temp_dir(reclaimed)
+
+        for kind, freed in reclaimed.items():
+            metrics.RECLAIMED_BYTES.inc(freed, kind=kind)
+        for reason, count in evicted.items():
+            metrics.SESSIONS_EVICTED.inc(count, reason=reason)
+        if any(reclaimed.values()) or any(evicted.values()):
+            logger.info(f"Reaper freed {reclaimed} bytes, removed sessions: {evicted}")
+        return reclaimed
+
+    def _reap(self, user_id: int, idle_before: float, whole: bool, reclaimed: dict) -> bool:
+        freed = self.session_manager.reap_session(user_id, idle_before, whole=whole)
+        if freed is None:
+            return False
+        reclaimed['pending_images'] += freed[0]
+        reclaimed['templates'] += freed[1]
+        return True
+
+    def _reap_idle(self, reclaimed: dict, evicted: dict):
+        now = time.time()
+        for user_id, _ in self.session_manager.get_users_by_activity(Config.SESSION_TTL):
+            if self._reap(user_id, now - Config.SESSION_TTL, True, reclaimed):
+                evicted['idle'] += 1
+
+        idle_users = [user_id for user_id, _ in self.session_manager.get_users_by_activity(Config.PENDING_IMAGES_TTL)]
+        for user_id in self.session_manager.get_pending_bytes(idle_users):
+            self._reap(user_id, now - Config.PENDING_IMAGES_TTL, False, reclaimed)
+
+    def _enforce_budget(self, reclaimed: dict, evicted: dict):
+        users = self.session_manager.get_users_by_activity()
+        pending = self.session_manager.get_pending_bytes([user_id for user_id, _ in users])
+        pending_bytes = sum(pending.values())
+        template_bytes = self.session_manager.get_template_bytes()
+
+        budget = Config.SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+        if budget and pending_bytes + template_bytes > budget:
+            # Templates nobody uses any more go first, they cost no one anything
+            freed = self.session_manager.delete_unreferenced_templates()
+            reclaimed['templates'] += freed
+            template_bytes -= freed
+
+            # Then whole sessions, least recently active first
+            idle_before = time.time() - Config.SESSION_EVICT_MIN_IDLE
+            for user_id, last_active in users:
+                if pending_bytes + template_bytes <= budget or last_active > idle_before:
+                    break
+                before = dict(reclaimed)
+                if not self._reap(user_id, idle_before, True, reclaimed):
+                    continue
+                evicted['budget'] += 1
+                pending_bytes -= reclaimed['pending_images'] - before['pending_images']
+                template_bytes -= reclaimed['templates'] - before['templates']
+
+            if pending_bytes + template_bytes > budget:
+                logger.warning(
+                    f"Session store still at {(pending_bytes + template_bytes) / 1024 / 1024:.1f} MB, over the "
+                    f"{Config.SESSION_MEMORY_BUDGET_MB} MB budget - everything left was active in the last "
+                    f"{Config.SESSION_EVICT_MIN_IDLE}s"
+                )
+
+        metrics.SESSION_STORE_BYTES.set(max(pending_bytes, 0), kind='pending_images')
+        metrics.SESSION_STORE_BYTES.set(max(template_bytes, 0), kind='templates')
+
+    def _sweep_temp_dir(self, reclaimed: dict):
+        """Deletes leftover temp files: expired ones, then the oldest while over budget."""
+        files = []
+        for root, _, filenames in os.walk(Config.TEMP_DIR):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # deleted while we were looking
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        budget = Config.TEMP_DIR_BUDGET_MB * 1024 * 1024
+        expired_before = time.time() - Config.TEMP_FILE_TTL
+        for mtime, size, path in files:
+            if mtime >= expired_before and (not budget or total <= budget):
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove temp file {path}: {e}")
+                continue
+            total -= size
+            reclaimed['temp_files'] += size
+        metrics.SESSION_STORE_BYTES.set(total, kind='temp_files')
@@ -0,0 +1,99 @@
+# template_cache.py
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+
+import metrics
+from compositor import Compositor
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class TemplateCache:
+    """LRU cache of decoded, composite-ready templates, bounded by total pixel memory.
+
+    Keys are (user_id, content hash), so a replaced template can never be
+    served stale. Each user keeps at most one decoded template.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = max_bytes if max_bytes is not None else Config.TEMPLATE_CACHE_MAX_MB * 1024 * 1024
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def shared(cls) -> 'TemplateCache':
+        """Process-wide cache shared by all ImageProcessors (e.g. thread workers)."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def hash_template(template_data: bytes) -> str:
+        """Content hash used to key a template."""
+        return hashlib.sha256(template_data).hexdigest()
+
+    def get(self, user_id, template_data: bytes, template_hash: str = None):
+        """Returns the PreparedTemplate for `template_data`, decoding it on a miss.
+
+        The returned arrays are shared and must not be modified.
+        """
+        key = (user_id, template_hash or self.hash_template(template_data))
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.TEMPLATE_CACHE_LOOKUPS.inc(result='hit')
+                return template
+            self.misses += 1
+        metrics.TEMPLATE_CACHE_LOOKUPS.inc(result='miss')
+
+        # Decode outside the lock so other workers aren't blocked
+        with metrics.stage('template_decode'), Image.open(BytesIO(template_data)) as image:
+            template = Compositor.prepare_template(image)
+        self._put(key, template)
+        return template
+
+    def _put(self, key, template):
+        size = template.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # Ek user ka ek hi template - naya aaya to purana hata do
+            self._drop_user(key[0])
+            self._entries[key] = template
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= evicted.nbytes
+
+    def _drop_user(self, user_id):
+        for key in [k for k in self._entries if k[0] == user_id]:
+            self._current_bytes -= self._entries.pop(key).nbytes
+
+    def invalidate_user(self, user_id):
+        """Drops a user's decoded template (on set_template / reset_session)."""
+        with self._lock:
+            self._drop_user(user_id)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and pixel memory in use."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+            }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The bot's modules live flat in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
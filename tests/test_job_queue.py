@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from config import Config
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_VISIBILITY_TIMEOUT', 1)
+    monkeypatch.setattr(Config, 'JOB_MAX_ATTEMPTS', 2)
+    server = fakeredis.FakeServer()
+    return JobQueue(
+        fakeredis.FakeRedis(server=server),
+        fakeredis.aioredis.FakeRedis(server=server),
+    )
+
+
+def test_enqueue_claim_and_complete(queue):
+    job_id = queue.enqueue({'image_keys': ['a']})
+    assert queue.depth() == 1
+
+    job = queue.claim(timeout=1)
+    assert job == (job_id, {'image_keys': ['a']}, 1)
+    assert queue.depth() == 0
+
+    queue.push_result(job_id, 1, b'result')
+    queue.complete(job_id)
+    assert queue.wait_event(job_id, 1) == {'type': 'result', 'index': 1, 'ok': True}
+    assert queue.get_result(job_id, 1) == b'result'
+    assert queue.wait_event(job_id, 1) == {'type': 'done', 'error': None}
+    assert queue.redis.llen(JobQueue.PROCESSING_KEY) == 0
+
+    queue.cleanup(job_id, 1)
+    assert queue.redis.keys('job:*') == []
+
+
+def test_failed_job_is_retried_then_dead_lettered(queue):
+    job_id = queue.enqueue({})
+    job = queue.claim(timeout=1)
+    queue.fail(job_id, job.attempts, 'boom')
+    assert queue.depth() == 1
+
+    job = queue.claim(timeout=1)
+    assert job.attempts == 2
+    queue.fail(job_id, job.attempts, 'boom')
+    assert queue.depth() == 0
+    assert queue.redis.lrange(JobQueue.DEAD_KEY, 0, -1) == [job_id.encode()]
+    assert queue.wait_event(job_id, 1) == {'type': 'done', 'error': 'boom'}
+
+
+def test_expired_claim_is_requeued(queue):
+    queue.enqueue({})
+    queue.claim(timeout=1)
+    assert queue.requeue_expired() == 0
+
+    time.sleep(1.1)
+    assert queue.requeue_expired() == 1
+    assert queue.claim(timeout=1).attempts == 2
+
+
+def test_dead_letter_list_is_capped(queue, monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_DEAD_LETTER_MAX', 2)
+    for _ in range(3):
+        queue.fail(queue.enqueue({}), Config.JOB_MAX_ATTEMPTS, 'boom')
+    assert queue.redis.llen(JobQueue.DEAD_KEY) == 2
+
+
+def test_wait_event_async(queue):
+    job_id = queue.enqueue({})
+
+    async def wait():
+        assert await queue.wait_event_async(job_id, 1) is None
+        queue.complete(job_id)
+        return await queue.wait_event_async(job_id, 1)
+
+    assert asyncio.run(wait()) == {'type': 'done', 'error': None}
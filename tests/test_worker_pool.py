@@ -0,0 +1,41 @@
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+
+import metrics
+import worker_pool
+from config import Config
+
+PINGS = metrics.REGISTRY.counter('test_worker_pings_total', 'Pings answered by workers.')
+
+
+class StubProcessor:
+    """Stands in for ImageProcessor so workers start without loading a model."""
+
+    rembg_session = None
+
+    def ping(self):
+        PINGS.inc()
+        time.sleep(0.2)  # keep both workers busy
+        return 'pong'
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_forked_workers_do_not_resend_inherited_samples(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'ImageProcessor', StubProcessor)
+    monkeypatch.setattr(worker_pool, 'preload_for_fork', lambda: False)
+    monkeypatch.setattr(Config, 'WORKER_START_METHOD', 'fork')
+    PINGS.inc(100)
+
+    async def run():
+        pool = worker_pool.WorkerPool(backend='process', max_workers=2)
+        try:
+            return await asyncio.gather(*(pool.submit('ping') for _ in range(4)))
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(run()) == ['pong'] * 4
+    # The 100 recorded before the fork once, plus one per ping
+    assert PINGS.take() == {(): 104}
@@ -0,0 +1,134 @@
+# webhook.py
+"""Webhook mode: one ASGI server receives Telegram updates and serves health and metrics.
+
+Run with `python webhook.py` (or `uvicorn webhook:app`) and BOT_MODE=webhook.
+Use a single server process - the bot's session and scheduling state lives
+in this event loop.
+
+Recorded updates can be replayed against a local server without Telegram:
+
+    python webhook.py --post update.json [--url http://localhost:8000/telegram]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import urllib.request
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+
+import metrics
+from bot_app import build_application
+from config import Config
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Built when the server starts, so replaying updates (--post) doesn't need Redis or workers
+application = None
+
+UPDATES_RECEIVED = metrics.REGISTRY.counter(
+    'bot_webhook_updates_total', 'Webhook requests by result.', ('result',)
+)
+
+
+async def telegram_webhook(request: Request) -> Response:
+    """Puts an incoming update on the application's queue and acknowledges it right away."""
+    if Config.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != Config.WEBHOOK_SECRET:
+        UPDATES_RECEIVED.inc(result='forbidden')
+        return PlainTextResponse('Forbidden', status_code=403)
+
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except Exception as e:
+        logger.warning(f"Rejected malformed webhook update: {e}")
+        UPDATES_RECEIVED.inc(result='invalid')
+        return PlainTextResponse('Bad Request', status_code=400)
+
+    # Processing happens in the application's own tasks, Telegram only waits for the ack
+    await application.update_queue.put(update)
+    UPDATES_RECEIVED.inc(result='accepted')
+    return Response(status_code=200)
+
+
+async def home(request: Request) -> Response:
+    """Provides a simple health check endpoint."""
+    is_running = application is not None and application.running
+    bot_status = "RUNNING" if is_running else "STOPPED"
+    return HTMLResponse(f"<h1>Bot status: {bot_status}</h1>", status_code=200 if is_running else 503)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus scrape endpoint: per-stage timings, throughput, cache and queue stats."""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global application
+    application = build_application(webhook=True)
+    async with application:
+        if Config.WEBHOOK_URL:
+            url = Config.WEBHOOK_URL.rstrip('/') + Config.WEBHOOK_PATH
+            await application.bot.set_webhook(
+                url=url,
+                secret_token=Config.WEBHOOK_SECRET or None,
+                allowed_updates=['message'],
+                max_connections=Config.MAX_CONCURRENT_UPDATES,
+            )
+            logger.info(f"Webhook registered at {url}")
+        else:
+            logger.warning("WEBHOOK_URL not set, webhook not registered with Telegram (local mode)")
+        await application.start()
+        logger.info("Bot is receiving updates via webhook.")
+        try:
+            yield
+        finally:
+            await application.stop()
+
+
+app = Starlette(
+    routes=[
+        Route(Config.WEBHOOK_PATH, telegram_webhook, methods=['POST']),
+        Route('/', home),
+        Route('/metrics', metrics_endpoint),
+    ],
+    lifespan=lifespan,
+)
+
+
+def post_update(path: str, url: str):
+    """Replays a recorded update (one JSON object or a list of them) against a running server."""
+    with open(path) as update_file:
+        updates = json.load(update_file)
+    for update in updates if isinstance(updates, list) else [updates]:
+        request = urllib.request.Request(
+            url, data=json.dumps(update).encode(), headers={'Content-Type': 'application/json'}
+        )
+        if Config.WEBHOOK_SECRET:
+            request.add_header(SECRET_HEADER, Config.WEBHOOK_SECRET)
+        with urllib.request.urlopen(request) as response:
+            print(f"update {update.get('update_id')}: HTTP {response.status}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--post', metavar='UPDATE_JSON', help='POST a recorded update file to a running server and exit')
+    parser.add_argument('--url', default=f"http://localhost:{Config.PORT}{Config.WEBHOOK_PATH}")
+    args = parser.parse_args()
+
+    if args.post:
+        post_update(args.post, args.url)
+    else:
+        import uvicorn
+        uvicorn.run(app, host='0.0.0.0', port=Config.PORT)
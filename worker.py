@@ -0,0 +1,168 @@
+# worker.py
+"""Stateless inference worker for the Redis job queue.
+
+Run any number of these on any number of machines pointing at the same
+REDIS_URL; each one starts N worker processes:
+
+    python worker.py --processes 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import signal
+import time
+
+import metrics
+from config import Config
+from cutout_cache import CutoutCache
+from encoder import normalize_format
+from image_processor import ImageProcessor
+from job_queue import JobQueue
+from model_registry import preload_for_fork
+from session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# How often a worker looks for jobs whose visibility timeout expired
+REQUEUE_INTERVAL = 10
+
+
+def process_job(job, job_queue: JobQueue, session_manager: SessionManager, processor: ImageProcessor, cutout_cache: CutoutCache):
+    """Runs one job: one background removal per image, then a result per image and size.
+
+    Image i at size s is result (i - 1) * len(sizes) + s.
+    """
+    payload = job.payload
+    user_id = payload['user_id']
+    model = payload.get('model') or Config.REMBG_MODEL
+    # Jobs queued before multi-size rendering carry a single width/height
+    sizes = payload.get('sizes') or [[payload['width'], payload['height']]]
+    template_data = session_manager.get_template_by_ref(payload['template_ref'])
+    if not template_data:
+        raise ValueError(f"Template {payload['template_ref']} not found")
+
+    def result_index(index, size_index):
+        return (index - 1) * len(sizes) + size_index
+
+    todo = [
+        (index, image_key) for index, image_key in enumerate(payload['image_keys'], 1)
+        if not all(job_queue.is_item_done(job.job_id, result_index(index, s)) for s in range(1, len(sizes) + 1))
+    ]
+    batch_size = Config.BATCH_MAX_SIZE
+    for start in range(0, len(todo), batch_size):
+        chunk = todo[start:start + batch_size]
+
+        cutouts, missing = {}, []
+        for index, image_key in chunk:
+            cached = cutout_cache.get(CutoutCache.model_key(image_key, model))
+            if cached is not None:
+                cutouts[index] = cached
+            else:
+                missing.append((index, image_key))
+
+        if missing:
+            images = [session_manager.get_pending_image_data(user_id, image_key) for _, image_key in missing]
+            # A chunk of inference on a slow tier can outlast the visibility timeout on its own
+            job_queue.touch(job.job_id)
+            results = processor.remove_background_batch(images, batch_size, encode=True, model=model)
+            job_queue.touch(job.job_id)
+            for (index, image_key), cutout in zip(missing, results):
+                if cutout is not None:
+                    cutout_cache.put(CutoutCache.model_key(image_key, model), cutout)
+                    cutouts[index] = cutout
+
+        for index, _ in chunk:
+            rendered = [None] * len(sizes)
+            if cutouts.get(index) is not None:
+                rendered = processor.render_sizes(
+                    cutouts[index], template_data, user_id, sizes,
+                    image_index=index, template_hash=payload.get('template_hash'),
+                    output_format=payload.get('output_format')
+                )
+            for size_index, result_data in enumerate(rendered, 1):
+                job_queue.push_result(job.job_id, result_index(index, size_index), result_data)
+                metrics.IMAGES_PROCESSED.inc(result='ok' if result_data else 'failed')
+            job_queue.touch(job.job_id)
+
+
+def run_worker(stop_event, metrics_port: int = 0):
+    """Main loop of one worker process."""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+    job_queue = JobQueue()
+    session_manager = SessionManager()
+    processor = ImageProcessor()
+    processor.rembg_session  # load + warm-up before claiming jobs
+    cutout_cache = CutoutCache(session_manager)
+    logger.info(f"Worker {multiprocessing.current_process().name} ready, waiting for jobs...")
+
+    last_requeue = 0.0
+    while not stop_event.is_set():
+        if time.monotonic() - last_requeue > REQUEUE_INTERVAL:
+            requeued = job_queue.requeue_expired()
+            if requeued:
+                logger.warning(f"Requeued {requeued} expired jobs")
+            last_requeue = time.monotonic()
+
+        job = job_queue.claim(timeout=5)
+        if job is None:
+            continue
+
+        logger.info(f"Processing job {job.job_id} (attempt {job.attempts}) for user {job.payload['user_id']}")
+        try:
+            process_job(job, job_queue, session_manager, processor, cutout_cache)
+            job_queue.complete(job.job_id)
+        except Exception as e:
+            job_queue.fail(job.job_id, job.attempts, str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run inference workers for the Redis job queue.")
+    parser.add_argument('--processes', type=int, default=Config.get_worker_count(),
+                        help="Worker processes on this machine (default: WORKER_COUNT or CPU cores)")
+    args = parser.parse_args()
+    try:
+        # Checked before the processes start, not when the first job fails
+        normalize_format(Config.OUTPUT_FORMAT)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    # With fork, load the model once here and let all worker processes share it
+    preload_for_fork()
+    context = multiprocessing.get_context(Config.WORKER_START_METHOD)
+    stop_event = context.Event()
+
+    def shutdown(signum, frame):
+        logger.info("Shutting down workers after their current job...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    processes = [
+        context.Process(
+            target=run_worker,
+            # Each process serves its own /metrics on consecutive ports
+            args=(stop_event, Config.WORKER_METRICS_PORT + i if Config.WORKER_METRICS_PORT else 0),
+            name=f"inference-worker-{i + 1}"
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} inference workers.")
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
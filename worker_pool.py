@@ -0,0 +1,125 @@
+# worker_pool.py
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from config import Config
+from image_processor import ImageProcessor
+from model_registry import preload_for_fork
+from template_cache import TemplateCache
+
+logger = logging.getLogger(__name__)
+
+# Har worker (process ya thread) ka apna ImageProcessor hota hai,
+# taki rembg session ek baar load ho aur warm rahe.
+_worker_state = threading.local()
+
+
+def _init_worker():
+    """Executor initializer: builds this worker's ImageProcessor and loads its model up front."""
+    _worker_state.processor = ImageProcessor()
+    _worker_state.processor.rembg_session  # load + warm-up before the first task arrives
+    logger.info(f"Image worker ready ({multiprocessing.current_process().name}, {threading.current_thread().name})")
+
+
+def _init_process_worker():
+    """_init_worker for process workers."""
+    # A forked worker starts with a copy of the parent's samples; drop them, or merge() counts them twice
+    metrics.REGISTRY.collect_delta()
+    _init_worker()
+
+
+def _get_processor() -> ImageProcessor:
+    processor = getattr(_worker_state, 'processor', None)
+    if processor is None:
+        _init_worker()
+        processor = _worker_state.processor
+    return processor
+
+
+def _run_task(method_name: str, *args, **kwargs):
+    """Runs a single ImageProcessor method inside a worker."""
+    return getattr(_get_processor(), method_name)(*args, **kwargs)
+
+
+def _run_task_with_metrics(method_name: str, *args, **kwargs):
+    """_run_task for process workers: also returns the metrics recorded meanwhile, for the parent to merge."""
+    result = _run_task(method_name, *args, **kwargs)
+    return result, metrics.REGISTRY.collect_delta()
+
+
+class WorkerPool:
+    """Runs ImageProcessor work off the asyncio event loop on a bounded pool of warm workers."""
+
+    BACKENDS = ('process', 'thread')
+
+    def __init__(self, backend: str = None, max_workers: int = None):
+        self.backend = (backend or Config.WORKER_BACKEND).lower()
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"Unknown worker backend '{self.backend}', expected one of {self.BACKENDS}")
+
+        self.max_workers = max_workers or Config.get_worker_count()
+        if self.backend == 'process':
+            # Forked workers then start with the model already loaded and share its memory
+            preload_for_fork()
+        self._executor = self._create_executor()
+        self._in_flight = metrics.REGISTRY.gauge('bot_worker_pool_tasks', 'Tasks submitted to the worker pool and not finished yet.')
+        logger.info(f"Worker pool started: backend={self.backend}, workers={self.max_workers}")
+
+    def _create_executor(self):
+        if self.backend == 'process':
+            mp_context = multiprocessing.get_context(Config.WORKER_START_METHOD)
+            return ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=mp_context,
+                initializer=_init_process_worker,
+            )
+        return ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='image-worker',
+            initializer=_init_worker,
+        )
+
+    async def submit(self, method_name: str, *args, **kwargs):
+        """Runs `ImageProcessor.<method_name>(*args, **kwargs)` on a worker and awaits the result."""
+        loop = asyncio.get_running_loop()
+        task = _run_task_with_metrics if self.backend == 'process' else _run_task
+        call = functools.partial(task, method_name, *args, **kwargs)
+        executor = self._executor
+        self._in_flight.inc()
+        try:
+            result = await loop.run_in_executor(executor, call)
+            if self.backend == 'process':
+                result, delta = result
+                metrics.REGISTRY.merge(delta)
+            return result
+        except BrokenProcessPool:
+            # Koi worker mar gaya (e.g. OOM) - pool dobara banao taki agli batch chal sake
+            if self._executor is executor:
+                logger.error("Worker process died unexpectedly, recreating the worker pool.")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._create_executor()
+            raise
+        finally:
+            self._in_flight.dec()
+
+    def invalidate_template(self, user_id: int):
+        """Drops a user's decoded template from the worker caches this process can reach.
+
+        Thread workers share this process's cache. Process workers key templates
+        by content hash, so a replaced template is never served stale there and
+        the old entry is dropped once the user's new template is used.
+        """
+        if self.backend == 'thread':
+            TemplateCache.shared().invalidate_user(user_id)
+
+    def shutdown(self, wait: bool = True):
+        """Stops all workers."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        logger.info("Worker pool shut down.")